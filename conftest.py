@@ -1,6 +1,21 @@
+import json
+
 import pytest
 
 @pytest.fixture
 def app():
     from iris import app as iris_app
     return iris_app
+
+@pytest.fixture
+def make_project(tmp_path):
+    """Create a project from a config in a temporary folder"""
+    from iris.project import Project
+
+    def make(config):
+        filename = tmp_path / 'project.json'
+        filename.write_text(json.dumps(config))
+        project = Project()
+        project.load_from(str(filename))
+        return project
+    return make
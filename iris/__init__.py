@@ -6,6 +6,7 @@ import sys
 
 import flask
 
+from iris.commands import COMMANDS
 from iris.extensions import db, compress
 from iris.project import project
 
@@ -21,7 +22,9 @@ def parse_cmd_line():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "mode", type=str,
-        help="Specify the mode you want to start iris, can be either *label* or *demo*."
+        help="Specify the mode you want to start iris, can be either *label* or "
+             "*demo*. Offline commands for a project are: "
+             + ", ".join(f"*{command}*" for command in COMMANDS)
     )
     parser.add_argument(
         "project", type=str, nargs='?',
@@ -38,15 +41,19 @@ def parse_cmd_line():
 
     if args.mode == "demo":
         args.project = get_demo_file()
-    elif args.mode == "label":
+    elif args.mode == "label" or args.mode in COMMANDS:
         if not args.project:
-            raise Exception("Label mode require a project file!")
+            raise Exception(f"{args.mode.capitalize()} mode require a project file!")
     else:
         raise Exception(f"Unknown mode '{args.mode}'!")
 
     return vars(args)
 
 def run_app():
+    if args.get('mode') in COMMANDS:
+        COMMANDS[args['mode']](project)
+        return
+
     create_default_admin(app)
     if args['production']:
         import gevent.pywsgi
@@ -28,6 +28,18 @@ def index():
 
     return flask.redirect(flask.url_for('admin.users'))
 
+@admin_app.route('/stats', methods=['GET'])
+@requires_admin
+def stats():
+    """Get the state of the caches, the prediction jobs and the CPU budget"""
+    return flask.jsonify({
+        'image_cache': project.image_cache.stats(),
+        'feature_cache': project.feature_cache.stats(),
+        'jobs': project.jobs.stats(),
+        'cpu_budget': project.cpu_budget.stats(),
+        'models': len(project.models),
+    })
+
 @admin_app.route('/users', methods=['GET'])
 @requires_auth
 def users():
@@ -105,7 +117,14 @@ def images():
         'difficulty': 0,
         'time_spent': timedelta(),
     }
-    for image_id in project.image_ids:
+    image_ids = project.image_ids
+    if order_by.startswith('metadata.') and project.metadata_index is not None:
+        # Sort by a metadata key, e.g. order_by=metadata.resolution:
+        image_ids = project.metadata_index.sort(
+            image_ids, order_by[len('metadata.'):], ascending
+        )
+
+    for image_id in image_ids:
         for action in actions:
             if action.image_id != image_id:
                 continue
@@ -0,0 +1,107 @@
+"""Count the annotations of each image
+
+"""
+from collections import defaultdict
+import threading
+
+# Up to this size, we compare all images of a bucket to find the closest one:
+SMALL_BUCKET_SIZE = 1000
+
+
+class AnnotationCounts:
+    """Number of annotations (actions) for each image, kept in memory
+
+    The counts are loaded once from the database and then updated whenever a
+    new action is created. The images are grouped into buckets by their number
+    of annotations, so that we can find the least annotated images without
+    going through all images or actions.
+    """
+    def __init__(self):
+        self.loaded = False
+        self.counts = {}
+        # Number of annotations -> set of image ids:
+        self.buckets = defaultdict(set)
+        # User id -> set of image ids annotated by the user:
+        self.user_images = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def load(self, image_ids):
+        """Load the counts from the database
+
+        Must be called within an app context.
+
+        Args:
+            image_ids: All image ids of the project.
+        """
+        from sqlalchemy import func
+        from iris.models import db, Action
+
+        rows = db.session.query(
+                Action.image_id, Action.user_id, func.count(Action.id)
+            ) \
+            .group_by(Action.image_id, Action.user_id) \
+            .all()
+
+        with self._lock:
+            self.counts = dict.fromkeys(image_ids, 0)
+            self.user_images = defaultdict(set)
+            for image_id, user_id, count in rows:
+                # Actions of images that are not part of the project anymore
+                # are ignored:
+                if image_id in self.counts:
+                    self.counts[image_id] += count
+                    self.user_images[user_id].add(image_id)
+
+            self.buckets = defaultdict(set)
+            for image_id, count in self.counts.items():
+                self.buckets[count].add(image_id)
+            self.loaded = True
+
+    def add(self, image_id, user_id):
+        """Register a new annotation of an image"""
+        with self._lock:
+            if not self.loaded or image_id not in self.counts:
+                return
+
+            count = self.counts[image_id]
+            self._remove_from_bucket(count, image_id)
+            self.counts[image_id] = count + 1
+            self.buckets[count + 1].add(image_id)
+            self.user_images[user_id].add(image_id)
+
+    def get_least_annotated(self, user_id, following_images, distance, exclude=()):
+        """Find the next least annotated image which the user has not annotated
+
+        Args:
+            user_id: Id of the user.
+            following_images: Iterable of image ids in the order in which
+                they are served to the user, starting after the current image.
+            distance: Function which returns the distance of an image id to the
+                current image in this order.
+            exclude: Image ids which must not be returned.
+
+        Returns:
+            The image id of the least annotated image closest to the current
+            one, or None if the user has already annotated all images.
+        """
+        with self._lock:
+            excluded = self.user_images[user_id].union(exclude)
+            for count in sorted(self.buckets):
+                bucket = self.buckets[count]
+                if len(bucket) <= len(bucket & excluded):
+                    continue
+
+                if len(bucket) <= SMALL_BUCKET_SIZE:
+                    return min(bucket - excluded, key=distance)
+
+                # For large buckets, it is faster to go through the following
+                # images until we hit one of the bucket:
+                for image_id in following_images:
+                    if image_id in bucket and image_id not in excluded:
+                        return image_id
+        return None
+
+    def _remove_from_bucket(self, count, image_id):
+        self.buckets[count].discard(image_id)
+        if not self.buckets[count]:
+            del self.buckets[count]
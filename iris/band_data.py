@@ -0,0 +1,103 @@
+"""Encode raw image bands for the browser
+
+The bands are sent as one binary blob, so that the browser can stretch and
+combine them itself. The blob starts with a 4 byte little-endian integer N,
+followed by a JSON header of N bytes and the data of all bands (band-major,
+row-major, little-endian). The header is padded, so that the data starts at a
+multiple of 8 bytes and can be read with JavaScript typed arrays directly.
+
+Example header:
+    {"height": 512, "width": 512, "dtype": "uint16",
+     "bands": [{"name": "$B1", "offset": 0.0, "scale": 1.0}]}
+
+The original values of each band are: offset + scale * stored value.
+"""
+import json
+import struct
+
+import numpy as np
+
+DTYPES = ('uint8', 'uint16', 'float16')
+
+
+def choose_dtype(arrays):
+    """Choose the smallest dtype which stores all bands without loss
+
+    Float bands are stored as float16, unless their values are too large for
+    it. These and integer bands outside of the uint16 range are quantised to
+    uint16.
+    """
+    if not all(np.issubdtype(array.dtype, np.integer) for array in arrays):
+        # Larger values would overflow:
+        limit = np.finfo(np.float16).max
+        if all(np.nanmax(np.abs(array)) <= limit for array in arrays):
+            return 'float16'
+        return 'uint16'
+    vmin = min(int(array.min()) for array in arrays)
+    vmax = max(int(array.max()) for array in arrays)
+    if vmin >= 0 and vmax <= 255:
+        return 'uint8'
+    return 'uint16'
+
+
+def encode_bands(bands, dtype='auto'):
+    """Encode bands into the binary format described in this module
+
+    Args:
+        bands: Dict with band names and 2D arrays of the same shape.
+        dtype: One of DTYPES or 'auto' (see choose_dtype). Bands which do not
+            fit into an integer dtype are linearly quantised between their
+            minimum and maximum.
+
+    Returns:
+        The encoded bands as bytes.
+    """
+    arrays = list(bands.values())
+    if dtype == 'auto':
+        dtype = choose_dtype(arrays)
+    if dtype not in DTYPES:
+        raise ValueError(
+            f"Unknown dtype '{dtype}'! Allowed are: auto, " + ", ".join(DTYPES)
+        )
+
+    height, width = arrays[0].shape
+    header = {'height': height, 'width': width, 'dtype': dtype, 'bands': []}
+    chunks = []
+    for name, array in bands.items():
+        data, offset, scale = quantise(array, dtype)
+        header['bands'].append({'name': name, 'offset': offset, 'scale': scale})
+        chunks.append(data.astype('<' + data.dtype.str[1:], copy=False).tobytes())
+
+    header = json.dumps(header).encode()
+    # Pad the header, so that the data is aligned to 8 bytes:
+    header += b' ' * (-(len(header) + 4) % 8)
+    return struct.pack('<I', len(header)) + header + b''.join(chunks)
+
+
+def quantise(array, dtype):
+    """Convert a band to dtype
+
+    Returns:
+        A tuple of the converted array, the offset and the scale with which
+        the original values are restored.
+    """
+    if dtype == 'float16':
+        return array.astype(np.float16), 0., 1.
+
+    info = np.iinfo(dtype)
+    if np.issubdtype(array.dtype, np.integer) \
+            and array.min() >= info.min and array.max() <= info.max:
+        return array.astype(dtype), 0., 1.
+
+    finite = np.isfinite(array)
+    if not finite.any():
+        return np.zeros(array.shape, dtype=dtype), 0., 1.
+    vmin = float(array[finite].min())
+    vmax = float(array[finite].max())
+    scale = (vmax - vmin) / info.max if vmax > vmin else 1.
+
+    data = np.where(finite, array, vmin).astype(np.float32)
+    data -= vmin
+    data /= scale
+    np.rint(data, out=data)
+    return data.astype(dtype), vmin, scale
@@ -0,0 +1,157 @@
+"""Store statistics of the image bands
+
+Stretching a view between the minimum and maximum or between percentiles of a
+band needs a full pass (or even a sort) over the band. Hence, these statistics
+are computed only once per image and band and stored as JSON files in the
+project directory.
+"""
+import json
+import os
+from os.path import exists, join
+import threading
+
+import numpy as np
+
+from iris.cache import ArrayCache
+
+# Percentiles which are stored for each band. Stretching with other clip values
+# interpolates between them:
+PERCENTILES = np.linspace(0, 100, 201)
+HISTOGRAM_BINS = 256
+
+
+def compute_band_stats(array):
+    """Compute the statistics of one band
+
+    Non-finite values (NaN, inf) are ignored.
+
+    Returns:
+        A dict with the minimum, the maximum, the values at PERCENTILES and a
+        histogram with HISTOGRAM_BINS bins between the minimum and maximum.
+    """
+    values = np.asarray(array).ravel()
+    finite = np.isfinite(values)
+    if not finite.all():
+        values = values[finite]
+    if not values.size:
+        values = np.zeros(1)
+
+    percentiles = np.percentile(values, PERCENTILES)
+    histogram, _ = np.histogram(
+        values, bins=HISTOGRAM_BINS, range=(percentiles[0], percentiles[-1])
+    )
+    return {
+        'min': float(percentiles[0]),
+        'max': float(percentiles[-1]),
+        'percentiles': percentiles,
+        'histogram': histogram,
+    }
+
+
+def get_percentile(stats, q):
+    """Get the q-th percentile (0-100) of a band from its statistics"""
+    return float(np.interp(q, PERCENTILES, stats['percentiles']))
+
+
+def compute_percentiles(array, qs):
+    """Compute percentiles of an array, without sorting it for 0 and 100"""
+    if all(q in (0, 100) for q in qs):
+        vmin, vmax = np.min(array), np.max(array)
+        return [float(vmin if q == 0 else vmax) for q in qs]
+    return [float(value) for value in np.percentile(array, qs)]
+
+
+class BandStatsStore:
+    """Band statistics of all images, persisted in a directory
+
+    Each image has one JSON file. It is tagged with a version (e.g. the
+    modification time of the image), so that outdated statistics are computed
+    again. The most recently used statistics are kept in memory.
+
+    Args:
+        path: Directory for the JSON files.
+        max_bytes: Memory budget for the statistics kept in memory.
+    """
+    def __init__(self, path, max_bytes=64*1024**2):
+        self.path = path
+        self._records = ArrayCache(max_bytes)
+        self._lock = threading.Lock()
+
+    def get(self, image_id, bands, version, load):
+        """Get the statistics of bands, compute them if necessary
+
+        Args:
+            image_id: Id of the image.
+            bands: List of band names, e.g. ["$B1", "$B2"].
+            version: JSON-serialisable value identifying the image data, e.g.
+                its modification time. Stored statistics with another version
+                are discarded.
+            load: Function which takes a list of band names and returns a dict
+                with their arrays. Called only for missing bands.
+
+        Returns:
+            A dict with the statistics (see compute_band_stats) per band.
+        """
+        record = self._load(image_id, version)
+        missing = [band for band in bands if band not in record['bands']]
+        if missing:
+            arrays = load(missing)
+            computed = {
+                band: compute_band_stats(arrays[band]) for band in missing
+            }
+            # Other requests might have added bands in the meantime:
+            with self._lock:
+                record = self._load(image_id, version)
+                record = {
+                    'version': record['version'],
+                    'bands': {**record['bands'], **computed},
+                }
+                self._save(image_id, record)
+
+        return {band: record['bands'][band] for band in bands}
+
+    def _get_filename(self, image_id):
+        return join(self.path, f'{image_id}.json')
+
+    def _load(self, image_id, version):
+        # Normalise the version, e.g. tuples become lists:
+        version = json.loads(json.dumps(version))
+
+        record = self._records.get(image_id)
+        if record is not None and record['version'] == version:
+            return record
+
+        filename = self._get_filename(image_id)
+        if exists(filename):
+            try:
+                with open(filename, 'r') as stream:
+                    record = json.load(stream)
+            except Exception as error:
+                print(f'Could not read band statistics of {image_id}: {error}')
+                record = None
+
+        if record is None or record.get('version') != version:
+            return {'version': version, 'bands': {}}
+
+        for stats in record['bands'].values():
+            stats['percentiles'] = np.array(stats['percentiles'])
+            stats['histogram'] = np.array(stats['histogram'])
+        self._records.put(image_id, record)
+        return record
+
+    def _save(self, image_id, record):
+        self._records.put(image_id, record)
+
+        bands = {
+            band: {
+                key: value.tolist() if isinstance(value, np.ndarray) else value
+                for key, value in stats.items()
+            }
+            for band, stats in record['bands'].items()
+        }
+        os.makedirs(self.path, exist_ok=True)
+        filename = self._get_filename(image_id)
+        tmp_filename = f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_filename, 'w') as stream:
+            json.dump({'version': record['version'], 'bands': bands}, stream)
+        os.replace(tmp_filename, filename)
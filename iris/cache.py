@@ -0,0 +1,173 @@
+"""Caches which are shared by all requests of the running IRIS process
+
+"""
+from collections import OrderedDict
+import os
+from os.path import dirname, exists, join
+import threading
+
+import numpy as np
+
+
+def get_nbytes(value):
+    """Get the number of bytes occupied by arrays in a (nested) dict/list"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    elif isinstance(value, dict):
+        return sum(map(get_nbytes, value.values()))
+    elif isinstance(value, (list, tuple)):
+        return sum(map(get_nbytes, value))
+    return 0
+
+
+def set_read_only(value):
+    """Protect cached arrays from being changed by their users"""
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, dict):
+        for v in value.values():
+            set_read_only(v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            set_read_only(v)
+
+
+class ArrayCache:
+    """Least-recently-used cache for numpy arrays with a memory budget
+
+    Values can be arrays or (nested) dicts/lists of arrays. All cached arrays
+    are made read-only, hence users must copy them before changing them.
+
+    Args:
+        max_bytes: Maximum number of bytes that all cached values may occupy
+            together. Set it to 0 to disable the cache.
+    """
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._items.move_to_end(key)
+            return self._items[key][0]
+
+    def put(self, key, value):
+        nbytes = get_nbytes(value)
+
+        with self._lock:
+            if key in self._items:
+                self.current_bytes -= self._items.pop(key)[1]
+
+            # Values that do not fit into the cache at all are not stored:
+            if nbytes > self.max_bytes:
+                return
+
+            set_read_only(value)
+            self._items[key] = (value, nbytes)
+            self.current_bytes += nbytes
+            self._evict()
+
+    def get_or_load(self, key, loader):
+        """Get the cached value or call loader() and cache its result"""
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            self.put(key, value)
+        return value
+
+    def resize(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'items': len(self._items),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+        }
+
+    def _evict(self):
+        # Remove the least recently used items until we are within the budget:
+        while self._items and self.current_bytes > self.max_bytes:
+            _, (_, nbytes) = self._items.popitem(last=False)
+            self.current_bytes -= nbytes
+
+
+class FileCache:
+    """Cache of files on disk, e.g. for rendered images
+
+    Concurrent requests for the same missing file are collapsed, i.e. only the
+    first one creates the file while the others wait for it.
+
+    Args:
+        path: Directory in which the cached files are stored.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get_filename(self, key):
+        return join(self.path, key[:2], key)
+
+    def get_or_create(self, key, creator):
+        """Get the filename of a cached file
+
+        Args:
+            key: Unique name of the file, e.g. a hash plus file extension.
+            creator: Function without arguments that returns the content of
+                the file as bytes. Only called if the file is not cached yet.
+
+        Returns:
+            The absolute filename of the cached file.
+        """
+        filename = self.get_filename(key)
+        if exists(filename):
+            return filename
+
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+
+        try:
+            with lock:
+                # Another request might have created the file in the meantime:
+                if not exists(filename):
+                    self._write(filename, creator())
+        finally:
+            with self._lock:
+                self._locks.pop(key, None)
+
+        return filename
+
+    def _write(self, filename, content):
+        os.makedirs(dirname(filename), exist_ok=True)
+
+        # Write to a temporary file first, so that nobody reads a half-written
+        # file:
+        tmp_filename = f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_filename, 'wb') as stream:
+            stream.write(content)
+        os.replace(tmp_filename, filename)
@@ -0,0 +1,257 @@
+"""Offline commands which can be run from the command line
+
+Each command gets the loaded project, e.g. `iris overviews project.json` calls
+build_overviews(project).
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import hashlib
+import json
+import os
+from os.path import dirname, exists, isdir, join, splitext
+import shutil
+
+import numpy as np
+
+import rasterio as rio
+from rasterio.enums import Resampling
+
+from iris.encoding import get_encoding
+from iris.tiles import TILE_SIZE, iterate_tiles
+
+
+def build_overviews(project):
+    """Build overviews for all GeoTIFF/VRT images which have none yet
+
+    The overviews are written to external .ovr files next to the images, i.e.
+    the images themselves are not changed. They make reading decimated images
+    (see images:decimate) much faster.
+    """
+    target_size = max(project['images']['shape'])
+
+    for image_id in project.image_ids:
+        filenames = project.get_image_path(image_id)
+        if not isinstance(filenames, dict):
+            filenames = {'': filenames}
+
+        for filename in filenames.values():
+            if not filename.lower().endswith(('vrt', 'tif', 'tiff')):
+                continue
+
+            with rio.open(filename) as file:
+                if file.overviews(1):
+                    continue
+
+                # The smallest overview should still be larger than the
+                # images we display:
+                factors = []
+                factor = 2
+                while max(file.height, file.width) // factor >= target_size:
+                    factors.append(factor)
+                    factor *= 2
+
+            if not factors:
+                continue
+
+            print(f'Build overviews {factors} for {filename}')
+            with rio.Env(TIFF_USE_OVR=True):
+                with rio.open(filename, 'r+') as file:
+                    file.build_overviews(factors, Resampling.average)
+
+
+def convert_images(project):
+    """Convert all images to band directories with one npy file per band
+
+    Each file is converted to a directory next to it, e.g. images/1/S2.tif to
+    images/1/S2.bands/ with the files B1.npy, B2.npy, ... These are memory-
+    mapped when they are read, hence only the bands which are displayed or used
+    by the AI are read from disk. Images which have not changed since the last
+    conversion are skipped. images:path has to be changed afterwards.
+    """
+    from iris.project import get_image_header, get_image_mtime
+
+    def convert(filename):
+        target = splitext(filename)[0] + '.bands'
+        if exists(target) and get_image_mtime(target) >= get_image_mtime(filename):
+            return
+
+        tmp_target = target + '.tmp'
+        shutil.rmtree(tmp_target, ignore_errors=True)
+        os.makedirs(tmp_target)
+        # Read band by band to keep the memory usage low:
+        for b in range(get_image_header(filename)[2]):
+            band = project._read_image(filename, bands=[f'$B{b+1}'])[f'B{b+1}']
+            np.save(join(tmp_target, f'B{b+1}.npy'), np.ascontiguousarray(band))
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(tmp_target, target)
+
+    filenames = []
+    for image_id in project.image_ids:
+        paths = project.get_image_path(image_id)
+        if not isinstance(paths, dict):
+            paths = {'': paths}
+        filenames.extend(path for path in paths.values() if not isdir(path))
+
+    with ThreadPoolExecutor(os.cpu_count()) as executor:
+        for i, _ in enumerate(executor.map(convert, filenames)):
+            if (i+1) % 100 == 0:
+                print(f'Converted {i+1}/{len(filenames)} files')
+    print(f'Converted all {len(filenames)} files.')
+
+    def get_template(template):
+        template = splitext(template)[0] + '.bands'
+        return os.path.relpath(template, dirname(project.file))
+
+    templates = project['images']['path']
+    if isinstance(templates, dict):
+        new_templates = {
+            key: get_template(template) for key, template in templates.items()
+        }
+    else:
+        new_templates = get_template(templates)
+    print(f'Set images:path to {json.dumps(new_templates)} to use them.')
+
+
+def compute_stats(project):
+    """Compute the statistics of all bands of all images
+
+    Otherwise they are computed when an image is displayed the first time.
+    """
+    for i, image_id in enumerate(project.image_ids):
+        project.get_band_stats(image_id)
+        if (i+1) % 100 == 0:
+            print(f'Computed statistics of {i+1}/{len(project.image_ids)} images')
+    print(f'Computed statistics of all {len(project.image_ids)} images.')
+
+
+def create_thumbnails(project):
+    """Create the thumbnails of all images in all sizes in parallel
+
+    Otherwise they are created when they are requested the first time.
+    """
+    from iris.project import THUMBNAIL_SIZES
+
+    def create(image_id):
+        for size in THUMBNAIL_SIZES:
+            project.get_thumbnail_file(image_id, (size, size))
+
+    # Reading and encoding the images releases the GIL, hence threads are
+    # sufficient:
+    with ThreadPoolExecutor(os.cpu_count()) as executor:
+        for i, _ in enumerate(executor.map(create, project.image_ids)):
+            if (i+1) % 100 == 0:
+                print(f'Created thumbnails of {i+1}/{len(project.image_ids)} images')
+    print(f'Created thumbnails of all {len(project.image_ids)} images.')
+
+
+def index_metadata(project):
+    """Parse all changed metadata files and store them in the metadata index"""
+    if project.metadata_index is None:
+        print('Enable images:metadata_index in the project file first.')
+        return
+
+    count = project.metadata_index.update(project.get_metadata_files())
+    print(f'Indexed {count} changed metadata files.')
+
+
+def precompute(project):
+    """Render all views of all images in advance with a process pool
+
+    Images which are larger than images:shape also get all their map tiles
+    rendered. Images whose files and views have not changed since the last run
+    are skipped, hence the command can be interrupted and run again.
+    """
+    manifest_file = join(project['path'], 'cache', 'precompute.json')
+    manifest = {}
+    if exists(manifest_file):
+        with open(manifest_file, 'r') as stream:
+            manifest = json.load(stream)
+
+    encoding = get_encoding(project['images']['encoding'])
+    keys = {
+        image_id: get_precompute_key(project, image_id, encoding)
+        for image_id in project.image_ids
+    }
+    todo = [
+        image_id for image_id in project.image_ids
+        if manifest.get(image_id) != keys[image_id]
+    ]
+    print(f'Skipping {len(keys) - len(todo)} unchanged images.')
+
+    with ProcessPoolExecutor(
+            initializer=_init_worker, initargs=(project.file,)) as executor:
+        futures = {
+            executor.submit(_precompute_image, image_id, encoding): image_id
+            for image_id in todo
+        }
+        for i, future in enumerate(as_completed(futures)):
+            image_id = futures[future]
+            try:
+                n_tiles = future.result()
+            except Exception as error:
+                print(f'Could not precompute image {image_id}: {error}')
+                continue
+
+            # Remember the finished images, so that we can resume later:
+            manifest[image_id] = keys[image_id]
+            os.makedirs(dirname(manifest_file), exist_ok=True)
+            with open(manifest_file + '.tmp', 'w') as stream:
+                json.dump(manifest, stream)
+            os.replace(manifest_file + '.tmp', manifest_file)
+            print(f'[{i+1}/{len(todo)}] Rendered image {image_id} ({n_tiles} tiles)')
+
+
+def get_precompute_key(project, image_id, encoding):
+    """Identify the inputs of everything precompute renders for an image"""
+    from iris.project import RENDER_VERSION
+
+    key = json.dumps(
+        [
+            RENDER_VERSION, project.get_image_mtime(image_id),
+            project['images']['shape'], project['images']['decimate'],
+            project['views'], encoding, TILE_SIZE
+        ],
+        sort_keys=True, default=str
+    )
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def _init_worker(project_file):
+    from iris.project import project
+
+    # Forked workers have got the loaded project already:
+    if project.file != project_file:
+        project.load_from(project_file)
+
+
+def _precompute_image(image_id, encoding):
+    from iris.project import project
+
+    project.prefetch_image(image_id, encoding)
+
+    height, width = project.get_image_size(image_id)
+    if max(height, width) <= max(project['images']['shape']):
+        return 0
+
+    n_tiles = 0
+    for view_name in project.view_expressions:
+        for z, x, y in iterate_tiles(height, width):
+            project.get_tile_file(image_id, view_name, z, x, y, encoding)
+            n_tiles += 1
+    return n_tiles
+
+
+def rescan(project):
+    """Search all image directories again and update the image index"""
+    project.scan_images(full=True)
+    print(f'Found {len(project.image_ids)} images.')
+
+
+COMMANDS = {
+    'convert': convert_images,
+    'overviews': build_overviews,
+    'precompute': precompute,
+    'metadata': index_metadata,
+    'rescan': rescan,
+    'stats': compute_stats,
+    'thumbnails': create_thumbnails,
+}
@@ -7,7 +7,8 @@ EXPLAIN_TEMPLATE_LOADING = True
 # Flask-SQLAlchemy settings
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
-# Flask-Compress settings
+# Flask-Compress settings. Images (PNG, WebP, JPEG) are compressed already,
+# hence they must not be listed here:
 COMPRESS_MIMETYPES = [
         'text/html', 'text/css', 'text/xml',
         'application/json', 'application/octet-stream',
@@ -0,0 +1,90 @@
+"""Share the CPU cores between the concurrent AI predictions
+
+LightGBM starts as many threads as it is told to. If every prediction used all
+cores, concurrent predictions would oversubscribe the CPU and all of them would
+get slower. Instead, each prediction asks the project's CPU budget for a share
+of the threads (segmentation:cpu_threads) and uses exactly this many.
+"""
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+
+class CPUBudget:
+    """Hand out shares of a fixed number of threads
+
+    The share of a task depends on how many tasks are running when it starts:
+    a lone task gets all threads, a task next to n running ones gets
+    n_threads // (n + 1) threads, but never more than are left (and at least
+    one). Hence, a new task can start immediately next to the running ones,
+    without waiting for a share to be released. Only more than max_tasks
+    tasks wait.
+
+    Args:
+        n_threads: Total number of threads. Default is the number of CPUs.
+        max_tasks: Number of tasks which run at the same time, e.g.
+            segmentation:prediction_workers.
+    """
+    def __init__(self, n_threads=None, max_tasks=1):
+        self.n_threads = n_threads or os.cpu_count()
+        self.max_tasks = max(1, max_tasks)
+        self.used = 0
+        self.running = 0
+        self.waiting = 0
+        self.n_tasks = 0
+        self.total_wait = 0.
+        self.max_wait = 0.
+        self._condition = threading.Condition()
+
+    def resize(self, n_threads=None, max_tasks=1):
+        with self._condition:
+            self.n_threads = n_threads or os.cpu_count()
+            self.max_tasks = max(1, max_tasks)
+            self._condition.notify_all()
+
+    @contextmanager
+    def acquire(self):
+        """Reserve a share of the threads for a task
+
+        Yields:
+            The number of threads the task may use.
+        """
+        start = time.time()
+        with self._condition:
+            self.waiting += 1
+            while self.running >= self.max_tasks:
+                self._condition.wait()
+            self.waiting -= 1
+
+            share = max(1, min(
+                self.n_threads - self.used,
+                self.n_threads // (self.running + 1)
+            ))
+            self.used += share
+            self.running += 1
+
+            wait = time.time() - start
+            self.n_tasks += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+        try:
+            yield share
+        finally:
+            with self._condition:
+                self.used -= share
+                self.running -= 1
+                self._condition.notify_all()
+
+    def stats(self):
+        return {
+            'threads': self.n_threads,
+            'max_tasks': self.max_tasks,
+            'used_threads': self.used,
+            'running': self.running,
+            'waiting': self.waiting,
+            'tasks': self.n_tasks,
+            'mean_wait': self.total_wait / self.n_tasks if self.n_tasks else 0.,
+            'max_wait': self.max_wait,
+        }
@@ -0,0 +1,109 @@
+"""Choose how the images are encoded for the responses
+
+The project config (images:encoding) defines the allowed formats and their
+options. Each request can override them with query arguments, e.g.
+/image/image1/RGB?format=jpeg&quality=80. Otherwise, the first allowed format
+that the browser accepts is used.
+"""
+from iris.utils import array_to_bytes
+
+MIMETYPES = {
+    'png': 'image/png',
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+}
+
+# Allowed ranges of the integer options. Each value makes its own cache file,
+# hence the options are not clamped silently but rejected:
+RANGES = {
+    'quality': (1, 100),
+    'compress_level': (0, 9),
+}
+
+
+def get_encoding(config, args=None, accept=None):
+    """Choose the encoding of an image
+
+    Args:
+        config: images:encoding of the project config.
+        args: Optional query arguments of the request. Can contain format
+            (one of the formats of the config), quality (webp and jpeg, 1 to
+            100), lossless (webp) and compress_level (png, 0 to 9).
+        accept: Optional Accept header of the request (werkzeug MIMEAccept).
+
+    Returns:
+        A dict with the format and its options, e.g.
+        {'format': 'png', 'compress_level': 1}.
+
+    Raises:
+        ValueError: If the query arguments are invalid.
+    """
+    args = args or {}
+    formats = config['formats']
+
+    if 'format' in args:
+        format = args['format'].lower()
+        if format not in formats:
+            raise ValueError(
+                f"Unknown format '{format}'! Allowed are: " + ", ".join(formats)
+            )
+    elif accept is not None:
+        mimetype = accept.best_match([MIMETYPES[f] for f in formats])
+        # Every browser can display PNG images:
+        format = 'png' if mimetype is None else formats[
+            [MIMETYPES[f] for f in formats].index(mimetype)
+        ]
+    else:
+        format = formats[0]
+
+    if format == 'png':
+        encoding = {
+            'format': 'png',
+            'compress_level': args.get('compress_level', config['png_compress_level']),
+        }
+    elif format == 'webp':
+        lossless = args.get('lossless', config['webp_lossless'])
+        if isinstance(lossless, str):
+            lossless = lossless.lower() in ('1', 'true', 'yes')
+        encoding = {
+            'format': 'webp',
+            'lossless': lossless,
+            'quality': args.get('quality', config['webp_quality']),
+        }
+    else:
+        encoding = {
+            'format': 'jpeg',
+            'quality': args.get('quality', config['jpeg_quality']),
+        }
+
+    for option, (low, high) in RANGES.items():
+        if option not in encoding:
+            continue
+        try:
+            encoding[option] = int(encoding[option])
+        except ValueError:
+            raise ValueError('Quality and compression level must be integers!')
+        if not low <= encoding[option] <= high:
+            raise ValueError(f'{option} must be between {low} and {high}!')
+
+    return encoding
+
+
+def encode_image(array, encoding):
+    """Encode an image array as bytes
+
+    Args:
+        array: Image as HxW or HxWx3 array, see array_to_bytes.
+        encoding: Format and options as returned by get_encoding.
+    """
+    options = dict(encoding)
+    format = options.pop('format')
+    return array_to_bytes(array, format.upper(), **options)
+
+
+def describe_encoding(encoding):
+    """Describe an encoding for response headers, e.g. 'png; compress_level=1'"""
+    return '; '.join(
+        [encoding['format']]
+        + [f'{key}={value}' for key, value in encoding.items() if key != 'format']
+    )
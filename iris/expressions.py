@@ -0,0 +1,290 @@
+"""Compile the band expressions of the views
+
+Views define their channels with expressions such as
+"edges($Sentinel2.B11**0.8*5)*1.5". Instead of evaluating them as Python code
+on each request, they are parsed once into a tree of numpy operations. Only
+numbers, band variables, arithmetic operators and a small set of functions are
+allowed.
+"""
+import ast
+import re
+
+import numpy as np
+from skimage.filters import sobel
+from skimage.segmentation import felzenszwalb
+
+FUNCTIONS = {
+    'max': np.max,
+    'min': np.min,
+    'mean': np.mean,
+    'median': np.median,
+    'log': np.log,
+    'exp': np.exp,
+    'sin': np.sin,
+    'cos': np.cos,
+    'edges': sobel,
+    'superpixels': felzenszwalb,
+}
+
+CONSTANTS = {
+    'PI': np.pi,
+}
+
+BINARY_OPERATORS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.true_divide,
+    ast.FloorDiv: np.floor_divide,
+    ast.Mod: np.mod,
+    ast.Pow: np.power,
+}
+
+# Band variables look like $B1 or $Sentinel2.B1:
+BAND_PATTERN = re.compile(r'\$(\w+)(?:\.(B\d+))?')
+
+
+class BandExpression:
+    """Band expression of a view compiled into a callable
+
+    Args:
+        expression: Expression as string, e.g. "$Sentinel2.B11**0.8*5".
+
+    Raises:
+        ValueError: If the expression cannot be parsed or contains anything
+            that is not allowed in band expressions.
+    """
+    def __init__(self, expression):
+        self.expression = expression
+        # The band variables used in this expression, e.g. ["$Sentinel2.B11"]:
+        self.bands = []
+
+        # Band variables are not valid python names, hence we replace them by
+        # placeholders before parsing:
+        def to_placeholder(match):
+            if match.group(0) not in self.bands:
+                self.bands.append(match.group(0))
+            return f'band_{self.bands.index(match.group(0))}_'
+
+        source = BAND_PATTERN.sub(to_placeholder, expression)
+        try:
+            tree = ast.parse(source.strip(), mode='eval')
+        except SyntaxError as error:
+            raise ValueError(
+                f"Invalid syntax in band expression '{expression}': {error.msg}"
+            )
+        self._evaluate = self._compile(tree.body)
+
+        # If the expression is just a scaled band, e.g. "$B1*2+1", we can
+        # derive its statistics directly from the statistics of the band:
+        affine = self._get_affine(tree.body)
+        if affine is not None and affine[0] is not None and affine[1] != 0:
+            self.affine = affine
+        else:
+            self.affine = None
+
+    def __repr__(self):
+        return f"<BandExpression '{self.expression}'>"
+
+    def __call__(self, image):
+        """Evaluate the expression
+
+        Args:
+            image: Dictionary of bands as returned by Project.get_image.
+
+        Returns:
+            A float32 array or a single number (if the expression does not
+            depend on any band). The array might be one of the (read-only)
+            bands of the image, so it must be copied before changing it.
+        """
+        return self._evaluate(image)[0]
+
+    def _compile(self, node):
+        """Compile an AST node to a function
+
+        The returned function takes the image dictionary and returns a tuple
+        of the result and a flag whether the result is a temporary array that
+        can be overwritten (so that we can compute the next steps in-place).
+        """
+        if isinstance(node, ast.Constant):
+            if not isinstance(node.value, (int, float)) \
+                    or isinstance(node.value, bool):
+                raise self._error(f"'{node.value}' is not a number")
+            value = float(node.value)
+            return lambda image: (value, False)
+        elif isinstance(node, ast.Name):
+            return self._compile_name(node.id)
+        elif isinstance(node, ast.BinOp):
+            return self._compile_binary_operation(node)
+        elif isinstance(node, ast.UnaryOp):
+            return self._compile_unary_operation(node)
+        elif isinstance(node, ast.Call):
+            return self._compile_call(node)
+
+        raise self._error(f"'{type(node).__name__}' is not allowed")
+
+    def _compile_name(self, name):
+        if name in CONSTANTS:
+            value = CONSTANTS[name]
+            return lambda image: (value, False)
+
+        match = re.fullmatch(r'band_(\d+)_', name)
+        if match is None:
+            raise self._error(f"Unknown variable '{name}'")
+
+        band = self.bands[int(match.group(1))]
+
+        def evaluate(image):
+            array = get_band(image, band)
+            result = array.astype(np.float32, copy=False)
+            return result, result is not array
+
+        return evaluate
+
+    def _compile_binary_operation(self, node):
+        operator = BINARY_OPERATORS.get(type(node.op))
+        if operator is None:
+            raise self._error(f"Operator '{type(node.op).__name__}' is not allowed")
+        left = self._compile(node.left)
+        right = self._compile(node.right)
+
+        def evaluate(image):
+            left_value, left_owned = left(image)
+            right_value, right_owned = right(image)
+            return apply_ufunc(
+                operator, (left_value, left_owned), (right_value, right_owned)
+            )
+
+        return evaluate
+
+    def _compile_unary_operation(self, node):
+        operand = self._compile(node.operand)
+        if isinstance(node.op, ast.UAdd):
+            return operand
+        elif isinstance(node.op, ast.USub):
+            return lambda image: apply_ufunc(np.negative, operand(image))
+
+        raise self._error(f"Operator '{type(node.op).__name__}' is not allowed")
+
+    def _compile_call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+            name = getattr(node.func, 'id', type(node.func).__name__)
+            raise self._error(
+                f"Unknown function '{name}', allowed are: " + ", ".join(FUNCTIONS)
+            )
+        function = FUNCTIONS[node.func.id]
+        args = [self._compile(arg) for arg in node.args]
+
+        # Keyword arguments are only allowed to be numbers, e.g. sigma=4:
+        kwargs = {}
+        for keyword in node.keywords:
+            if keyword.arg is None or not isinstance(keyword.value, ast.Constant):
+                raise self._error(
+                    f"Keyword arguments of '{node.func.id}' must be numbers"
+                )
+            kwargs[keyword.arg] = keyword.value.value
+
+        def evaluate(image):
+            result = function(*[arg(image)[0] for arg in args], **kwargs)
+            if isinstance(result, np.ndarray):
+                return result.astype(np.float32, copy=False), True
+            return float(result), False
+
+        return evaluate
+
+    def _get_affine(self, node):
+        """Express an AST node as scale*band + offset
+
+        Returns:
+            A tuple of band name (None for constants), scale and offset, or None
+            if the node is not an affine function of a single band.
+        """
+        if isinstance(node, ast.Constant):
+            if isinstance(node.value, bool):
+                return None
+            return None, 0., float(node.value)
+        elif isinstance(node, ast.Name):
+            if node.id in CONSTANTS:
+                return None, 0., CONSTANTS[node.id]
+            match = re.fullmatch(r'band_(\d+)_', node.id)
+            return self.bands[int(match.group(1))], 1., 0.
+        elif isinstance(node, ast.UnaryOp):
+            operand = self._get_affine(node.operand)
+            if operand is None:
+                return None
+            band, scale, offset = operand
+            if isinstance(node.op, ast.USub):
+                return band, -scale, -offset
+            return operand
+        elif not isinstance(node, ast.BinOp):
+            return None
+
+        left = self._get_affine(node.left)
+        right = self._get_affine(node.right)
+        if left is None or right is None:
+            return None
+        (left_band, left_scale, left_offset) = left
+        (right_band, right_scale, right_offset) = right
+
+        if isinstance(node.op, (ast.Add, ast.Sub)):
+            if left_band is not None and right_band is not None:
+                return None
+            sign = 1 if isinstance(node.op, ast.Add) else -1
+            return (
+                left_band if left_band is not None else right_band,
+                left_scale + sign*right_scale, left_offset + sign*right_offset
+            )
+        elif isinstance(node.op, ast.Mult):
+            if left_band is None:
+                return right_band, left_offset*right_scale, left_offset*right_offset
+            elif right_band is None:
+                return left_band, left_scale*right_offset, left_offset*right_offset
+        elif isinstance(node.op, ast.Div):
+            if right_band is None and right_offset != 0:
+                return left_band, left_scale/right_offset, left_offset/right_offset
+        elif left_band is None and right_band is None:
+            # Other operations of constants, e.g. 2**3:
+            return None, 0., float(BINARY_OPERATORS[type(node.op)](left_offset, right_offset))
+
+        return None
+
+    def _error(self, message):
+        return ValueError(f"{message} in band expression '{self.expression}'")
+
+
+def get_band(image, band):
+    """Get a band from an image dictionary as returned by Project.get_image
+
+    Args:
+        image: Dictionary of bands.
+        band: Band variable, e.g. "$B1" or "$Sentinel2.B1".
+    """
+    file_id, band_id = BAND_PATTERN.fullmatch(band).groups()
+    if band_id is None:
+        return image[band]
+    return image[file_id][band_id]
+
+
+def apply_ufunc(ufunc, *operands):
+    """Apply a numpy ufunc and reuse temporary arrays for the output
+
+    Args:
+        ufunc: A numpy ufunc, e.g. np.add.
+        *operands: Tuples of values and a flag whether the value is a temporary
+            array that can be overwritten.
+
+    Returns:
+        Tuple of the result and True if it is an array.
+    """
+    values = [value for value, _ in operands]
+    result_shape = np.broadcast_shapes(*[np.shape(value) for value in values])
+
+    for value, owned in operands:
+        if owned and isinstance(value, np.ndarray) \
+                and value.shape == result_shape and value.dtype == np.float32:
+            return ufunc(*values, out=value), True
+
+    result = ufunc(*values)
+    if isinstance(result, np.ndarray):
+        return result.astype(np.float32, copy=False), True
+    return float(result), False
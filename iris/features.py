@@ -0,0 +1,81 @@
+"""Build the per-pixel inputs of the AI model
+
+The inputs only depend on the image and on a few options of
+segmentation:ai_model, not on the labels of the user. Hence, the project keeps
+them in a cache (see Project.get_features), so that repeated predictions for
+the same image only fit and apply the model.
+"""
+import numpy as np
+from skimage.filters import sobel
+from skimage.segmentation import felzenszwalb
+
+# Options of segmentation:ai_model which change the inputs:
+FEATURE_OPTIONS = (
+    'bands', 'use_edge_filter', 'use_meshgrid', 'meshgrid_cells',
+    'use_superpixels'
+)
+
+
+def image_dict_to_array(image_dict):
+    if isinstance(image_dict, np.ndarray):
+        return image_dict
+
+    return np.dstack(
+        [image_dict_to_array(v) for v in image_dict.values()]
+    )
+
+
+def build_features(image, ai_model):
+    """Build the inputs of the AI model for all pixels of an image
+
+    Args:
+        image: Image as HxWxC array or (nested) dict of bands, see
+            Project.get_image.
+        ai_model: segmentation:ai_model of the (user) config.
+
+    Returns:
+        A C-contiguous float32 array with one row per pixel (row-major) and
+        one column per feature: the bands, their edges (use_edge_filter), the
+        cell indices (use_meshgrid) and the superpixel ids (use_superpixels).
+    """
+    image = image_dict_to_array(image)
+    height, width, n_channels = image.shape
+
+    n_features = n_channels
+    if ai_model['use_edge_filter']:
+        n_features += n_channels
+    if ai_model['use_meshgrid']:
+        n_features += 2
+    if ai_model['use_superpixels']:
+        n_features += 1
+
+    # Each feature is written into its column directly, without temporary
+    # float64 stacks:
+    features = np.empty((height, width, n_features), dtype=np.float32)
+    features[..., :n_channels] = image
+    column = n_channels
+
+    if ai_model['use_edge_filter']:
+        for i in range(n_channels):
+            features[..., column] = sobel(image[..., i])
+            column += 1
+
+    if ai_model['use_meshgrid']:
+        if ai_model['meshgrid_cells'] == "pixelwise":
+            x_size, y_size = height, width
+        else:
+            x_size, y_size = map(int, ai_model['meshgrid_cells'].split('x'))
+        y_size = 3
+        x = np.repeat(np.arange(x_size), int(height/x_size)+1)
+        y = np.repeat(np.arange(y_size), int(width/y_size)+1)
+        x_grid, y_grid = np.meshgrid(x[:height], y[:width])
+        features[..., column] = x_grid
+        features[..., column+1] = y_grid
+        column += 2
+
+    if ai_model['use_superpixels']:
+        features[..., column] = felzenszwalb(
+            image, scale=height/5, sigma=4, min_size=100
+        )
+
+    return features.reshape(height * width, n_features)
@@ -0,0 +1,127 @@
+"""Keep an index of the image ids of a project on disk
+
+Searching all images of a project can take very long on network storage.
+Hence, we store the found ids together with the modification times of their
+directories. At the next start, only directories that have changed since then
+are searched again.
+"""
+import json
+import os
+from os.path import basename, dirname, exists, getmtime, isdir, join
+import re
+
+
+class ImageIndex:
+    """Index of the image ids of a project
+
+    Args:
+        filename: JSON file in which the index is stored.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.templates = {}
+
+        if exists(filename):
+            try:
+                with open(filename, 'r') as stream:
+                    self.templates = json.load(stream)['templates']
+            except Exception as error:
+                print(f'Could not read image index, rebuilding it: {error}')
+
+    def scan(self, templates, full=False):
+        """Find all image ids for the given path templates
+
+        An image id is only returned if the files for all templates exist.
+
+        Args:
+            templates: List of path templates with a placeholder {id}, e.g.
+                ["images/{id}/S1.tif", "images/{id}/S2.tif"].
+            full: If true, all directories are searched again, even those
+                that have not changed since the last scan.
+
+        Returns:
+            Sorted list of image ids.
+        """
+        ids_per_template = [
+            self._scan_template(template, full) for template in templates
+        ]
+        self.save()
+
+        image_ids = set.intersection(*ids_per_template)
+        incomplete = set.union(*ids_per_template) - image_ids
+        if incomplete:
+            print(
+                f'Ignoring {len(incomplete)} images which do not have all '
+                f'files, e.g. {sorted(incomplete)[:5]}'
+            )
+
+        return sorted(image_ids)
+
+    def save(self):
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as stream:
+            json.dump({'templates': self.templates}, stream)
+        os.replace(tmp_filename, self.filename)
+
+    def _scan_template(self, template, full):
+        before, id_str, after = template.partition("{id}")
+        if not id_str or "{id}" in after:
+            raise Exception('[CONFIG] images:path must contain exactly one placeholder "{id}"!')
+        # The files of an image are opened by replacing {id} in the template,
+        # hence all other parts of it have to be literal:
+        if any(wildcard in before + after for wildcard in '*?'):
+            raise Exception(
+                f'[CONFIG] images:path "{template}" must not contain wildcards '
+                '(* or ?), only the placeholder "{id}"!'
+            )
+
+        # The directory which contains the entries (files or directories) with
+        # the image ids in their names:
+        root = dirname(before)
+        suffix, _, rest = after.partition(os.sep)
+        regex_entry = re.compile(
+            re.escape(basename(before)) + "(?P<id>.+)" + re.escape(suffix)
+        )
+
+        if not isdir(root):
+            return set()
+
+        index = self.templates.get(template, {})
+        if full:
+            index = {}
+        root_mtime = getmtime(root)
+
+        # Only list the directory if something was added or removed:
+        if index.get('root_mtime') == root_mtime:
+            entries = index['entries']
+        else:
+            entries = {
+                name: index.get('entries', {}).get(name)
+                for name in os.listdir(root)
+                if regex_entry.fullmatch(name)
+            }
+
+        for name, entry in entries.items():
+            if not rest:
+                # The image id is part of the filename:
+                entries[name] = [regex_entry.fullmatch(name).group('id'), None, True]
+                continue
+
+            # The image id is a directory, its file(s) are further down:
+            filename = join(root, name, rest)
+            parent = dirname(filename)
+            mtime = getmtime(parent) if isdir(parent) else None
+            if entry is not None and mtime is not None and entry[1] == mtime:
+                continue
+
+            entries[name] = [
+                regex_entry.fullmatch(name).group('id'), mtime, exists(filename)
+            ]
+
+        self.templates[template] = {
+            'root_mtime': root_mtime,
+            'entries': entries,
+        }
+        return {
+            image_id for image_id, _, valid in entries.values() if valid
+        }
@@ -0,0 +1,61 @@
+"""Personalised orders in which the images are served to the users
+
+"""
+import threading
+
+import numpy as np
+
+
+class ImageOrder:
+    """Random order of the images for one user
+
+    The order is fully defined by the user's seed, hence it can always be
+    regenerated. Swapping images (when prioritising unmarked images) only
+    changes this order, never the image ids of the project.
+
+    Args:
+        image_ids: List of all image ids of the project.
+        seed: Random seed of the user.
+    """
+    def __init__(self, image_ids, seed):
+        self.seed = seed
+
+        indices = list(range(len(image_ids)))
+        np.random.RandomState(seed=seed).shuffle(indices)
+        self.image_ids = [image_ids[i] for i in indices]
+        self._positions = {
+            image_id: position
+            for position, image_id in enumerate(self.image_ids)
+        }
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def __getitem__(self, position):
+        return self.image_ids[position % len(self.image_ids)]
+
+    def position(self, image_id):
+        return self._positions[image_id]
+
+    def next(self, image_id):
+        return self[self.position(image_id) + 1]
+
+    def previous(self, image_id):
+        return self[self.position(image_id) - 1]
+
+    def following(self, image_id):
+        """Iterate over all other images, starting after image_id"""
+        position = self.position(image_id)
+        for i in range(1, len(self.image_ids)):
+            yield self[position + i]
+
+    def distance(self, image_id, other_id):
+        """Number of steps from image_id forward to other_id"""
+        return (self.position(other_id) - self.position(image_id)) % len(self)
+
+    def swap(self, image_id, other_id):
+        with self._lock:
+            a, b = self._positions[image_id], self._positions[other_id]
+            self.image_ids[a], self.image_ids[b] = other_id, image_id
+            self._positions[image_id], self._positions[other_id] = b, a
@@ -0,0 +1,224 @@
+"""Run long tasks like the AI predictions outside of the requests
+
+The production server (gevent) handles all requests in one thread. A request
+which trains a model for seconds would block all other users in the meantime.
+Hence, such tasks are submitted as jobs: the request only returns the id of
+the job and the client polls for its result.
+
+Each job runs in a thread of this process, so it can use the caches of the
+project. CPU-heavy parts are handed over to a pool of worker processes with
+JobQueue.run_in_process.
+
+Cancelled jobs are skipped as long as they wait for a thread or a worker
+process. A job which is already running in a worker process is not stopped,
+its result is discarded when it finishes.
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import threading
+import time
+import uuid
+
+
+class QueueFull(Exception):
+    """Raised if too many jobs are waiting already"""
+
+
+class JobCancelled(Exception):
+    """Raised in a job which was superseded by a newer job of its owner"""
+
+
+class Job:
+    """A submitted task and its result
+
+    Attributes:
+        id: Unique id as string.
+        owner: Id of the user who submitted the job.
+        status: One of 'queued', 'running', 'done', 'failed' or 'cancelled'.
+        result: Return value of the task once the job is done.
+        error: Error message if the job failed.
+    """
+    def __init__(self, owner):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'error': self.error,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+class JobQueue:
+    """Bounded queue of jobs with one job per owner
+
+    Submitting a new job cancels the previous job of the same owner, e.g. when
+    a user presses the AI button again before the last prediction finished.
+
+    Args:
+        max_workers: Number of jobs which run at the same time (and of worker
+            processes). Set it to 0 to run the jobs directly when they are
+            submitted.
+        max_queued: Maximum number of jobs which wait for a free worker.
+    """
+    def __init__(self, max_workers=0, max_queued=0):
+        self.max_workers = 0
+        self.max_queued = max_queued
+        self._threads = None
+        self._processes = None
+        # Job id -> job:
+        self._jobs = {}
+        # Owner -> id of their last job:
+        self._owners = {}
+        self._lock = threading.Lock()
+        # Number of started jobs and their total waiting time in the queue:
+        self.n_started = 0
+        self.total_wait = 0.
+        self.resize(max_workers, max_queued)
+
+    def resize(self, max_workers, max_queued):
+        with self._lock:
+            self._shutdown()
+            self.max_workers = max_workers
+            self.max_queued = max_queued
+            if max_workers:
+                self._threads = ThreadPoolExecutor(
+                    max_workers, thread_name_prefix='job'
+                )
+                # The processes are started on demand:
+                self._processes = ProcessPoolExecutor(max_workers)
+            self._jobs = {}
+            self._owners = {}
+
+    def submit(self, owner, task, *args):
+        """Submit a job
+
+        Args:
+            owner: Id of the user who submits the job.
+            task: Function which is called with the job and args. Its return
+                value becomes the result of the job.
+
+        Returns:
+            The new job.
+
+        Raises:
+            QueueFull: If max_queued jobs are waiting already.
+        """
+        job = Job(owner)
+        with self._lock:
+            previous = self._jobs.get(self._owners.get(owner))
+            if self._threads is not None:
+                # The previous job of the owner is replaced, it does not count:
+                n_queued = sum(
+                    j.status == 'queued' for j in self._jobs.values()
+                    if j is not previous
+                )
+                if n_queued >= self.max_queued:
+                    raise QueueFull(
+                        f'There are already {n_queued} jobs waiting, try again later!'
+                    )
+
+            if previous is not None:
+                del self._jobs[previous.id]
+                self._cancel(previous)
+            self._jobs[job.id] = job
+            self._owners[owner] = job.id
+            if self._threads is not None:
+                self._threads.submit(self._run, job, task, args)
+                return job
+
+        self._run(job, task, args)
+        return job
+
+    def get(self, job_id):
+        """Get a job by its id, None if it is unknown or was superseded"""
+        return self._jobs.get(job_id)
+
+    def run_in_process(self, job, function, *args):
+        """Run function(*args) in a worker process and return its result
+
+        Without worker processes, the function is called directly. Cancelled
+        jobs do not reach the worker processes, but a function which has been
+        handed over already is not stopped.
+
+        Raises:
+            JobCancelled: If the job was cancelled in the meantime.
+        """
+        if job.cancelled.is_set():
+            raise JobCancelled()
+        processes = self._processes
+        if processes is None:
+            return function(*args)
+
+        try:
+            return processes.submit(function, *args).result()
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory), the next jobs need a new pool:
+            with self._lock:
+                if self._processes is processes:
+                    self._processes = ProcessPoolExecutor(self.max_workers)
+            raise
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+            n_started, total_wait = self.n_started, self.total_wait
+        return {
+            'max_workers': self.max_workers,
+            'max_queued': self.max_queued,
+            'queued': sum(job.status == 'queued' for job in jobs),
+            'running': sum(job.status == 'running' for job in jobs),
+            'mean_wait': total_wait / n_started if n_started else 0.,
+        }
+
+    def _run(self, job, task, args):
+        if job.cancelled.is_set():
+            return
+
+        job.status = 'running'
+        job.started = time.time()
+        with self._lock:
+            self.n_started += 1
+            self.total_wait += job.started - job.submitted
+        try:
+            job.result = task(job, *args)
+            job.status = 'done'
+        except JobCancelled:
+            job.status = 'cancelled'
+        except Exception as error:
+            print(f'Job {job.id} failed: {error}')
+            job.error = str(error)
+            job.status = 'failed'
+        finally:
+            job.finished = time.time()
+            job.done.set()
+
+    def _cancel(self, job):
+        # A running job stops at its next call of run_in_process, see there:
+        job.cancelled.set()
+        if job.status == 'queued':
+            job.status = 'cancelled'
+            job.finished = time.time()
+            job.done.set()
+
+    def _shutdown(self):
+        for job in self._jobs.values():
+            self._cancel(job)
+        if self._threads is not None:
+            self._threads.shutdown(wait=False, cancel_futures=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=False, cancel_futures=True)
+        self._threads = None
+        self._processes = None
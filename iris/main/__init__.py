@@ -1,14 +1,13 @@
-import io
 import json
 
 import flask
 import markupsafe
-import numpy as np
-from PIL import Image as PILImage
-from skimage.transform import resize
 
+from iris.band_data import DTYPES
+from iris.encoding import MIMETYPES, describe_encoding, get_encoding
 from iris.models import db, Action
 from iris.project import project
+from iris.tiles import TILE_SIZE, get_max_zoom
 from iris.user import requires_auth
 
 main_app = flask.Blueprint(
@@ -25,8 +24,119 @@ def index():
 
 @main_app.route('/image/<image_id>/<view>')
 def image(image_id, view):
-    image = project.render_image(image_id, project['views'][view])
-    return array_to_png(image)
+    if not project.has_image(image_id):
+        return flask.make_response('Unknown image!', 404)
+    if view not in project['views']:
+        return flask.make_response('Unknown view!', 404)
+
+    try:
+        encoding = get_request_encoding()
+    except ValueError as error:
+        return flask.make_response(str(error), 400)
+
+    # The rendered views are cached on disk. send_file answers with 304 if the
+    # browser has already got the current version of it:
+    timings = {}
+    filename = project.get_view_file(image_id, view, encoding, timings)
+    return send_image(filename, encoding, timings)
+
+@main_app.route('/bands/<image_id>')
+def bands(image_id):
+    """Get the raw bands of an image as binary, see iris.band_data
+
+    Query arguments:
+        view: Send the bands which are required by this view.
+        bands: Otherwise, a comma-separated list of bands, e.g. $B1,$B2.
+            Default are all bands.
+        dtype: auto (default), uint8, uint16 or float16.
+
+    The data is compressed with gzip if the browser accepts it.
+    """
+    if not project.has_image(image_id):
+        return flask.make_response('Unknown image!', 404)
+
+    all_bands = project.get_image_bands(image_id)
+    if 'view' in flask.request.args:
+        if flask.request.args['view'] not in project.view_expressions:
+            return flask.make_response('Unknown view!', 404)
+        bands = project.get_view_bands(flask.request.args['view'])
+    elif 'bands' in flask.request.args:
+        bands = flask.request.args['bands'].split(',')
+        unknown = [band for band in bands if band not in all_bands]
+        if unknown:
+            return flask.make_response(f'Unknown bands: {", ".join(unknown)}', 404)
+    else:
+        bands = all_bands
+
+    dtype = flask.request.args.get('dtype', 'auto')
+    if dtype != 'auto' and dtype not in DTYPES:
+        return flask.make_response(
+            "Unknown dtype! Allowed are: auto, " + ", ".join(DTYPES), 400
+        )
+
+    compress = 'gzip' in flask.request.accept_encodings
+    filename = project.get_bands_file(image_id, bands, dtype, compress)
+
+    # This mimetype is not compressed by flask_compress again:
+    response = flask.send_file(filename, mimetype='application/x-iris-bands')
+    response.vary.add('Accept-Encoding')
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+@main_app.route('/tiles/<image_id>')
+def tiles(image_id):
+    """Get the layout of the tile pyramid of an image"""
+    if not project.has_image(image_id):
+        return flask.make_response('Unknown image!', 404)
+
+    height, width = project.get_image_size(image_id)
+    return flask.jsonify({
+        'height': height,
+        'width': width,
+        'tile_size': TILE_SIZE,
+        'max_zoom': get_max_zoom(height, width),
+    })
+
+@main_app.route('/tile/<image_id>/<view>/<int:z>/<int:x>/<int:y>')
+def tile(image_id, view, z, x, y):
+    """Get a map tile of a view, see iris.tiles"""
+    if not project.has_image(image_id):
+        return flask.make_response('Unknown image!', 404)
+    if view not in project.view_expressions:
+        return flask.make_response('Unknown view!', 404)
+
+    try:
+        encoding = get_request_encoding()
+    except ValueError as error:
+        return flask.make_response(str(error), 400)
+
+    timings = {}
+    filename = project.get_tile_file(image_id, view, z, x, y, encoding, timings)
+    if filename is None:
+        return flask.make_response('Unknown tile!', 404)
+    return send_image(filename, encoding, timings)
+
+@main_app.route('/histogram/<image_id>/<band>')
+def histogram(image_id, band):
+    """Get the statistics of an image band, e.g. /histogram/image1/B1
+
+    The band is given without $, e.g. B1 or Sentinel2.B1. The histogram has
+    256 bins between min and max.
+    """
+    if not project.has_image(image_id):
+        return flask.make_response('Unknown image!', 404)
+
+    band = '$' + band
+    if band not in project.get_image_bands(image_id):
+        return flask.make_response('Unknown band!', 404)
+
+    stats = project.get_band_stats(image_id, [band])[band]
+    return flask.jsonify({
+        'min': stats['min'],
+        'max': stats['max'],
+        'histogram': stats['histogram'].tolist(),
+    })
 
 @main_app.route('/image_info/<image_id>')
 @requires_auth
@@ -101,22 +211,49 @@ def metadata(image_id):
 
 @main_app.route('/thumbnail/<image_id>', methods=['GET'])
 def thumbnail(image_id):
+    if not project.has_image(image_id):
+        return flask.make_response('Unknown image!', 404)
+
     size = flask.request.args.get("size", None)
-    array = project.get_thumbnail(image_id)
+    try:
+        if size is not None:
+            size = tuple(map(int, size.split("x")))
+            if len(size) != 2 or min(size) < 1:
+                raise ValueError('size must look like 256x256')
+        encoding = get_request_encoding()
+    except ValueError as error:
+        return flask.make_response(
+            f'Invalid size or encoding: {error}', 400
+        )
 
-    if size is not None:
-        print(size, tuple(size.split("x")))
-        size = map(int, size.split("x"))
-        array = resize(array, size)
+    timings = {}
+    filename = project.get_thumbnail_file(image_id, size, encoding, timings)
+    if filename is None:
+        return flask.make_response("No thumbnail found!", 404)
 
-    return array_to_png(array)
+    return send_image(filename, encoding, timings)
+
+def get_request_encoding():
+    """Choose the image encoding from the query arguments and Accept header"""
+    return get_encoding(
+        project['images']['encoding'], flask.request.args,
+        flask.request.accept_mimetypes
+    )
 
-def array_to_png(array):
-    if issubclass(array.dtype.type, np.floating):
-        array = np.clip(array * 255., 0, 255).astype('uint8')
+def send_image(file, encoding, timings):
+    """Send an encoded image file
 
-    img = PILImage.fromarray(array) # convert arr to image
-    file_object = io.BytesIO()   # create file in memory
-    img.save(file_object, 'PNG') # save PNG in file in memory
-    file_object.seek(0)          # move to beginning of file
-    return flask.send_file(file_object,  mimetype='image/png')
+    The durations in timings (in seconds) are reported in the Server-Timing
+    header and the encoding in the X-Image-Encoding header, so that the
+    encoding options can be tuned in the network tab of the browser.
+    """
+    response = flask.send_file(file, mimetype=MIMETYPES[encoding['format']])
+    # The format depends on the Accept header of the browser:
+    response.vary.add('Accept')
+    response.headers['X-Image-Encoding'] = describe_encoding(encoding)
+    if timings:
+        response.headers['Server-Timing'] = ', '.join(
+            f'{name};dur={duration*1000:.1f}'
+            for name, duration in timings.items()
+        )
+    return response
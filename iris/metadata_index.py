@@ -0,0 +1,149 @@
+"""Keep the metadata of all images in one SQLite database
+
+Parsing a JSON or YAML file whenever the metadata of an image is requested is
+slow. If images:metadata_index is enabled, the parsed metadata is stored in a
+database in the project directory together with the modification time of its
+file. Files are only parsed again when they have changed.
+"""
+import json
+from os.path import exists, getmtime
+import sqlite3
+import threading
+
+import yaml
+
+
+def read_metadata(filename):
+    """Read a metadata file
+
+    JSON and YAML files are parsed, all other files are returned as text in
+    the key "__body__".
+    """
+    with open(filename, 'r') as stream:
+        if filename.endswith('json'):
+            return json.load(stream)
+        elif filename.endswith('yaml'):
+            return yaml.safe_load(stream)
+        else:
+            return {"__body__": stream.read()}
+
+
+class MetadataIndex:
+    """Index of the metadata of all images
+
+    Args:
+        filename: Filename of the SQLite database.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        # Image id -> (modification time, metadata):
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        with self._lock:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS metadata '
+                '(image_id TEXT PRIMARY KEY, mtime REAL, data TEXT)'
+            )
+            self._connection.commit()
+
+    def get(self, image_id, filename):
+        """Get the metadata of an image
+
+        Args:
+            image_id: Id of the image.
+            filename: Metadata file of the image.
+
+        Returns:
+            The metadata as dict or an empty dict if there is no file. It is
+            shared by all callers, so it must not be changed.
+        """
+        if not exists(filename):
+            return {}
+        mtime = getmtime(filename)
+
+        cached = self._cache.get(image_id)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT mtime, data FROM metadata WHERE image_id = ?',
+                (image_id,)
+            ).fetchone()
+        if row is not None and row[0] == mtime:
+            metadata = json.loads(row[1])
+        else:
+            metadata = self._parse(filename)
+            self._store([(image_id, mtime, metadata)])
+
+        self._cache[image_id] = (mtime, metadata)
+        return metadata
+
+    def update(self, files):
+        """Parse all changed metadata files and store them
+
+        Args:
+            files: Dict of image ids and their metadata files.
+
+        Returns:
+            The number of parsed files.
+        """
+        with self._lock:
+            mtimes = dict(self._connection.execute(
+                'SELECT image_id, mtime FROM metadata'
+            ).fetchall())
+
+        changed = []
+        for image_id, filename in files.items():
+            if not exists(filename):
+                continue
+            mtime = getmtime(filename)
+            if mtimes.get(image_id) != mtime:
+                changed.append((image_id, mtime, self._parse(filename)))
+
+        self._store(changed)
+        return len(changed)
+
+    def sort(self, image_ids, key, ascending=True):
+        """Sort image ids by a (top-level) key of their metadata
+
+        Only images which are already in the index are sorted by their value,
+        all others are appended at the end.
+        """
+        # The key is compared as value instead of being put into a JSON path,
+        # so that it can contain any characters:
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT image_id FROM metadata, json_each(metadata.data) '
+                "WHERE json_each.key = ? AND json_each.type != 'null' "
+                f'ORDER BY json_each.value {"ASC" if ascending else "DESC"}',
+                (key,)
+            ).fetchall()
+
+        image_ids = set(image_ids)
+        sorted_ids = [row[0] for row in rows if row[0] in image_ids]
+        sorted_set = set(sorted_ids)
+        return sorted_ids + sorted(image_ids - sorted_set)
+
+    def _parse(self, filename):
+        # The metadata should look the same whether it comes from the file or
+        # from the database, e.g. YAML dates are converted to strings:
+        return json.loads(json.dumps(read_metadata(filename), default=str))
+
+    def _store(self, items):
+        if not items:
+            return
+
+        with self._lock:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO metadata (image_id, mtime, data) '
+                'VALUES (?, ?, ?)',
+                [
+                    (image_id, mtime, json.dumps(metadata, default=str))
+                    for image_id, mtime, metadata in items
+                ]
+            )
+            self._connection.commit()
+        for image_id, mtime, metadata in items:
+            self._cache[image_id] = (mtime, metadata)
@@ -0,0 +1,114 @@
+"""Keep the last AI model of each user and image
+
+A user presses the AI button many times per image and usually only adds a few
+strokes in between. Instead of training a new model each time, the last model
+is trained further on the new labels (LightGBM's init_model). If the labels
+have changed a lot, or the options of the model, it is trained from scratch.
+"""
+from collections import OrderedDict
+import threading
+
+import numpy as np
+
+MAX_MODELS = 50
+# Models with more iterations than this times ai_model:n_estimators are trained
+# from scratch again, so that they do not grow without limit:
+MAX_TREES_FACTOR = 4
+
+
+def encode_labels(user_indices, user_labels):
+    """Combine pixel indices and labels into one sorted array of codes"""
+    return np.sort(
+        user_indices.astype(np.int64) * 256 + user_labels.astype(np.int64)
+    )
+
+
+def get_label_change(old_codes, new_codes):
+    """Get the share of labelled pixels which are new or changed (0 to 1)"""
+    if not len(old_codes) or not len(new_codes):
+        return 1.
+    n_same = len(np.intersect1d(old_codes, new_codes))
+    return 1. - n_same / max(len(old_codes), len(new_codes))
+
+
+class ModelStore:
+    """Least-recently-used store of the models of the users
+
+    The keys are tuples of user id and image id. Each value is a dict with the
+    model (LightGBM model string), its number of boosting iterations, the
+    options it was trained with and the codes of the labelled pixels (see
+    encode_labels).
+
+    Args:
+        max_models: Maximum number of stored models.
+    """
+    def __init__(self, max_models=MAX_MODELS):
+        self.max_models = max_models
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._models)
+
+    def get(self, user_id, image_id):
+        with self._lock:
+            model = self._models.get((user_id, image_id))
+            if model is not None:
+                self._models.move_to_end((user_id, image_id))
+            return model
+
+    def get_init_model(self, user_id, image_id, options, codes, ai_model):
+        """Get the model which should be trained further, if there is one
+
+        Args:
+            user_id: Id of the user.
+            image_id: Id of the image.
+            options: Options of the model as string, must be the same as for
+                the stored model.
+            codes: Codes of the new labelled pixels, see encode_labels.
+            ai_model: segmentation:ai_model of the user config.
+
+        Returns:
+            The stored model (see ModelStore) or None if a new model should
+            be trained.
+        """
+        if not ai_model['warm_start']:
+            return None
+        model = self.get(user_id, image_id)
+        if model is None or model['options'] != options:
+            return None
+        # A new class needs a new model:
+        classes = np.unique(codes % 256)
+        if not np.array_equal(classes, np.unique(model['codes'] % 256)):
+            return None
+        if model['n_iterations'] >= MAX_TREES_FACTOR * ai_model['n_estimators']:
+            return None
+        if get_label_change(model['codes'], codes) > ai_model['retrain_threshold']:
+            return None
+        return model
+
+    def put(self, user_id, image_id, model):
+        with self._lock:
+            self._models.pop((user_id, image_id), None)
+            self._models[(user_id, image_id)] = model
+            while len(self._models) > self.max_models:
+                self._models.popitem(last=False)
+
+    def drop(self, user_id, image_id=None):
+        """Drop the model of a user for an image or all their models
+
+        Returns:
+            The number of dropped models.
+        """
+        with self._lock:
+            keys = [
+                key for key in self._models
+                if key[0] == user_id and image_id in (None, key[1])
+            ]
+            for key in keys:
+                del self._models[key]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
@@ -0,0 +1,164 @@
+"""Train the AI model on the labels of a user and predict the whole mask
+
+This runs in the worker processes of the job queue (see iris.jobs), hence all
+arguments are plain arrays, dicts or filenames.
+"""
+import lightgbm as lgb
+import numpy as np
+from scipy.ndimage import convolve
+
+# Size of the blocks over which the sampled pixels are spread:
+SPREAD_BLOCK_SIZE = 16
+
+
+def spread_order(rows, cols, rng):
+    """Order pixels so that each prefix of them is spread over the image
+
+    The pixels are grouped into blocks of SPREAD_BLOCK_SIZE. The order takes
+    one random pixel of each block, then a second one of each block, etc.
+
+    Returns:
+        Indices which sort the pixels.
+    """
+    n_block_cols = cols.max() // SPREAD_BLOCK_SIZE + 1 if len(cols) else 1
+    blocks = (rows // SPREAD_BLOCK_SIZE) * n_block_cols + cols // SPREAD_BLOCK_SIZE
+
+    shuffled = rng.permutation(len(blocks))
+    blocks = blocks[shuffled]
+    # The rank of each pixel within its block:
+    by_block = np.argsort(blocks, kind='stable')
+    sorted_blocks = blocks[by_block]
+    starts = np.flatnonzero(np.r_[True, sorted_blocks[1:] != sorted_blocks[:-1]])
+    counts = np.diff(np.r_[starts, len(blocks)])
+    ranks = np.empty(len(blocks), dtype=int)
+    ranks[by_block] = np.arange(len(blocks)) - np.repeat(starts, counts)
+
+    return shuffled[np.argsort(ranks, kind='stable')]
+
+
+def sample_pixels(user_indices, user_labels, width, ai_model, seed=42):
+    """Split the labelled pixels into training and validation pixels
+
+    Each class is split by ai_model:train_ratio, but contributes at most
+    ai_model:max_train_pixels training pixels (like the sampling in the
+    browser). The validation pixels are capped in the same ratio, so the time
+    to fit the model is bounded however much the user has drawn. The sampled
+    pixels are spread over the image instead of coming from one stroke.
+
+    Args:
+        user_indices: Indices of the labelled pixels in the mask.
+        user_labels: Classes of these pixels.
+        width: Width of the mask.
+        ai_model: segmentation:ai_model of the user config.
+        seed: Seed of the random sampling.
+
+    Returns:
+        A tuple of the training indices, training labels, validation indices
+        and validation labels.
+    """
+    rng = np.random.default_rng(seed)
+    train_ratio = ai_model['train_ratio']
+    train_indices, train_labels, val_indices, val_labels = [], [], [], []
+    for label in np.unique(user_labels):
+        indices = user_indices[user_labels == label]
+        indices = indices[spread_order(indices // width, indices % width, rng)]
+
+        n_train = min(
+            max(1, round(len(indices) * train_ratio)),
+            ai_model['max_train_pixels']
+        )
+        n_val = min(
+            len(indices) - n_train,
+            max(1, round(n_train * (1 - train_ratio) / train_ratio))
+        )
+        train_indices.append(indices[:n_train])
+        train_labels.append(np.full(n_train, label))
+        val_indices.append(indices[n_train:n_train+n_val])
+        val_labels.append(np.full(n_val, label))
+
+    return (
+        np.concatenate(train_indices), np.concatenate(train_labels),
+        np.concatenate(val_indices), np.concatenate(val_labels),
+    )
+
+
+def fit_and_predict(inputs, user_indices, user_labels, ai_model, mask_shape,
+                    n_threads=1, seed=42, init_model=None):
+    """Fit a LightGBM classifier and predict the classes of all pixels
+
+    Args:
+        inputs: Inputs of all pixels, see iris.features.build_features, or
+            the name of a npy file with them (see Project.get_features_file).
+        user_indices: Indices of the pixels labelled by the user.
+        user_labels: Classes of these pixels.
+        ai_model: segmentation:ai_model of the user config.
+        mask_shape: Shape (width, height) of the mask.
+        n_threads: Number of threads for LightGBM (its n_jobs), see
+            iris.cpu_budget.
+        seed: Seed of the sampling of the labelled pixels, see sample_pixels.
+        init_model: Optional LightGBM model string of a previous fit. It is
+            trained further with a quarter of ai_model:n_estimators trees.
+
+    Returns:
+        A tuple of the predicted classes of all pixels as uint8 array, the
+        fitted model as string and its number of boosting iterations.
+    """
+    if isinstance(inputs, str):
+        inputs = np.load(inputs, mmap_mode='r')
+
+    train_indices, train_labels, val_indices, val_labels = sample_pixels(
+        user_indices, user_labels, mask_shape[0], ai_model, seed
+    )
+
+    gbm = lgb.LGBMClassifier(
+        num_leaves=ai_model['n_leaves'],
+        max_bin=128,
+        max_depth=ai_model['max_depth'],
+        # min_data_in_leaf=1000,
+        # bagging_fraction=0.2,
+        # boosting_type='dart',
+        tree_learner='data',
+        learning_rate=0.05,
+        n_estimators=ai_model['n_estimators'] if init_model is None
+            else max(1, ai_model['n_estimators'] // 4),
+        n_jobs=n_threads,
+    )
+    if init_model is not None:
+        # The new trees only have to correct the previous model:
+        init_model = lgb.Booster(model_str=init_model)
+    if len(val_indices):
+        early_stopping = lgb.early_stopping(4, verbose=False)
+        gbm.fit(
+            inputs[train_indices, :], train_labels,
+            eval_set=[(inputs[val_indices, :], val_labels)],
+            callbacks=[early_stopping], init_model=init_model
+        )
+    else:
+        # Too few pixels for early stopping:
+        gbm.fit(inputs[train_indices, :], train_labels, init_model=init_model)
+
+    # predict the mask for the whole image:
+    predictions = gbm.predict(
+        inputs, num_iteration=gbm.best_iteration_
+    )
+    predictions = predictions.astype(np.uint8)
+
+    # Apply suppression filter:
+    if ai_model['suppression_threshold'] != 0:
+        other_classes = (predictions != ai_model['suppression_default_class']).astype(int)
+        other_classes = other_classes.reshape(*mask_shape)
+        window_size = ai_model['suppression_filter_size']
+        window = np.ones((window_size, window_size))
+        window[window_size//2, window_size//2] = 0
+        neighbourhood_ratio = convolve(
+            other_classes, window, mode='constant', cval=0.5
+        ) / (window_size**2 - 1)
+        suppress = 100 * neighbourhood_ratio.ravel() < ai_model['suppression_threshold']
+        predictions[suppress] = ai_model['suppression_default_class']
+
+    booster = gbm.booster_
+    n_iterations = gbm.best_iteration_ or booster.current_iteration()
+    return (
+        predictions, booster.model_to_string(num_iteration=n_iterations),
+        n_iterations
+    )
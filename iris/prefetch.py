@@ -0,0 +1,77 @@
+"""Prepare the next image of the users in the background
+
+When a user opens an image, we already know which image they get next. Its
+views are rendered while the user is still working on the current image, so
+that clicking on "next" only hits the caches.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait
+import threading
+
+
+class Prefetcher:
+    """Run prefetch tasks in a small pool of threads
+
+    Each user has at most one task. Scheduling a new task for a user cancels
+    the previous one, e.g. when the user jumps to another image.
+
+    Args:
+        max_workers: Number of threads. Set it to 0 to disable prefetching.
+    """
+    def __init__(self, max_workers=0):
+        self.max_workers = 0
+        self._executor = None
+        # User id -> (image id, cancel event, future):
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self.resize(max_workers)
+
+    def resize(self, max_workers):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self.max_workers = max_workers
+            self._executor = None
+            if max_workers:
+                self._executor = ThreadPoolExecutor(
+                    max_workers, thread_name_prefix='prefetch'
+                )
+            self._tasks = {}
+
+    def schedule(self, user_id, image_id, task):
+        """Schedule the prefetching of an image for a user
+
+        Args:
+            user_id: Id of the user.
+            image_id: Id of the image to prefetch.
+            task: Function which takes the image id and a threading.Event. It
+                should return early once the event is set.
+        """
+        with self._lock:
+            if self._executor is None:
+                return
+
+            current = self._tasks.get(user_id)
+            if current is not None:
+                if current[0] == image_id and not current[2].done():
+                    return
+                # The user went somewhere else:
+                current[1].set()
+                current[2].cancel()
+
+            cancelled = threading.Event()
+            future = self._executor.submit(self._run, task, image_id, cancelled)
+            self._tasks[user_id] = (image_id, cancelled, future)
+
+    def wait(self, user_id, timeout=None):
+        """Wait until the task of a user is finished"""
+        current = self._tasks.get(user_id)
+        if current is not None:
+            wait([current[2]], timeout)
+
+    def _run(self, task, image_id, cancelled):
+        if cancelled.is_set():
+            return
+        try:
+            task(image_id, cancelled)
+        except Exception as error:
+            print(f'Could not prefetch image {image_id}: {error}')
@@ -1,36 +1,100 @@
 """Take care of holding the current project's configurations
 
 """
-from copy import deepcopy
-from glob import glob
+from collections import OrderedDict
+import functools
+import gzip
+import hashlib
+import io
 from numbers import Number
 import os
-from os.path import basename, dirname, exists, getmtime, isabs, join, normpath
-from pprint import pprint
+from os.path import (
+    basename, dirname, exists, getmtime, isabs, isdir, join, normpath
+)
 import re
+import threading
+import time
 
 import flask
 import markupsafe
 
 import json
-from matplotlib import cm
+import matplotlib
 import numpy as np
+from PIL import Image as PILImage
 from skimage.io import imread
-from skimage.filters import sobel
-from skimage.segmentation import felzenszwalb
 import yaml
 import rasterio as rio
-
-from iris.utils import merge_deep_dicts
+from rasterio.windows import Window
+
+from iris.annotations import AnnotationCounts
+from iris.band_data import encode_bands
+from iris.band_stats import BandStatsStore, compute_percentiles, get_percentile
+from iris.cache import ArrayCache, FileCache
+from iris.cpu_budget import CPUBudget
+from iris.encoding import MIMETYPES, encode_image, get_encoding
+from iris.expressions import BAND_PATTERN, BandExpression, get_band
+from iris.features import FEATURE_OPTIONS, build_features
+from iris.image_index import ImageIndex
+from iris.image_order import ImageOrder
+from iris.jobs import JobQueue
+from iris.metadata_index import MetadataIndex, read_metadata
+from iris.model_store import ModelStore
+from iris.prefetch import Prefetcher
+from iris.tiles import get_tile_window
+from iris.utils import freeze, merge_deep_dicts
+
+# Increase this whenever the output of render_image changes, so that the views
+# rendered by older versions are not taken from the cache anymore:
+RENDER_VERSION = 4
+
+# Thumbnails are created in these sizes (maximum of width and height). Other
+# requested sizes are rounded up, so that the browser can scale them down:
+THUMBNAIL_SIZES = (64, 128, 256, 512)
+
+# Maximum number of personalised image orders kept in memory:
+MAX_IMAGE_ORDERS = 100
 
 class Project:
     def __init__(self):
-        # Each user is going to get a personalised random sequence of images:
-        self.random_state = np.random.RandomState(seed=0)
-        self.image_order = None
         self.image_ids = None
+        self._image_positions = {}
+        # Each user is going to get a personalised random sequence of images:
+        self.default_image_order = None
+        self._image_orders = OrderedDict()
+        self._image_orders_lock = threading.Lock()
+        self.annotations = AnnotationCounts()
         self.file = None
         self.debug = False
+        # Decoded image bands, shared by all requests:
+        self.image_cache = ArrayCache()
+        # Inputs of the AI model, see get_features:
+        self.feature_cache = ArrayCache()
+        self.view_cache = None
+        self.thumbnail_cache = None
+        self.tile_cache = None
+        self.bands_cache = None
+        self.feature_files = None
+        # Optional index of the parsed metadata files:
+        self.metadata_index = None
+        # Prepares the next images of the users in the background:
+        self.prefetcher = Prefetcher()
+        # Runs the AI predictions outside of the requests:
+        self.jobs = JobQueue()
+        # Threads for the AI predictions:
+        self.cpu_budget = CPUBudget()
+        # Last AI model of each user and image:
+        self.models = ModelStore()
+        # Merged project and user configs: user id -> (mtimes, config)
+        self._user_configs = {}
+        # Statistics of the image bands for stretching the views:
+        self.band_stats = None
+        # Compiled band expressions for each view:
+        self.view_expressions = {}
+        # Number of bands for each image path template:
+        self._band_counts = {}
+        # Size (height, width) of each image:
+        self._image_sizes = {}
 
     def load_from(self, filename):
         if not isabs(filename):
@@ -60,9 +124,29 @@ class Project:
             self.config['name'] = ".".join(basename(filename).split(".")[:-1])
 
         self._init_paths_and_files(filename)
+        self.image_cache.resize(self['images']['cache_size'])
+        self.feature_cache.resize(self['segmentation']['feature_cache_size'])
+        self.jobs.resize(
+            self['segmentation']['prediction_workers'],
+            self['segmentation']['prediction_queue_size']
+        )
+        self.cpu_budget.resize(
+            self['segmentation']['cpu_threads'],
+            self['segmentation']['prediction_workers']
+        )
+        self.prefetcher.resize(self['images']['prefetch_workers'])
 
-        # Default seed
-        self.set_image_seed(0)
+        formats = self['images']['encoding']['formats']
+        if not formats or any(f not in MIMETYPES for f in formats):
+            raise Exception(
+                '[CONFIG] images:encoding:formats must be a list of: '
+                + ', '.join(MIMETYPES)
+            )
+        for format in formats:
+            try:
+                get_encoding(self['images']['encoding'], {'format': format})
+            except ValueError as error:
+                raise Exception(f'[CONFIG] images:encoding: {error}')
 
         if self.segmentation:
             self.config['segmentation']['mask_shape'] = (
@@ -105,6 +189,23 @@ class Project:
                 # a single channel image:
                 view['data'] = [view['data']]
                 view['cmap'] = view.get('cmap', 'jet')
+            if 'data' in view:
+                self.view_expressions[name] = self._compile_view(view)
+
+        # Missing thumbnails are rendered from the first image view of the
+        # default view group by default:
+        if self['images'].get('thumbnail_view') is None:
+            candidates = self.config.get('view_groups', {}).get('default', [])
+            candidates = [
+                name for name in candidates + list(self['views'])
+                if name in self.view_expressions
+            ]
+            self['images']['thumbnail_view'] = candidates[0] if candidates else None
+        elif self['images']['thumbnail_view'] not in self.view_expressions:
+            raise Exception(
+                f"[CONFIG] images:thumbnail_view '{self['images']['thumbnail_view']}' "
+                "must be the name of an image view!"
+            )
 
         self._normalise_classes(self.config)
         for mode in ['segmentation', 'classification', 'detection']:
@@ -118,6 +219,43 @@ class Project:
         if "debug" not in self.config:
             self['debug'] = False
 
+    def _compile_view(self, view):
+        """Compile the band expressions of a view and check its bands"""
+        if isinstance(self['images']['path'], dict):
+            file_ids = list(self['images']['path'].keys())
+        else:
+            file_ids = None
+
+        expressions = []
+        for expression in view['data']:
+            try:
+                expression = BandExpression(expression)
+            except ValueError as error:
+                raise Exception(f"[CONFIG] Error in view '{view['name']}': {error}")
+
+            for band in expression.bands:
+                prefix, band_id = BAND_PATTERN.fullmatch(band).groups()
+                if file_ids is None:
+                    valid = band_id is None and re.fullmatch(r'B\d+', prefix)
+                else:
+                    valid = prefix in file_ids and band_id is not None
+                if not valid:
+                    raise Exception(
+                        f"[CONFIG] Unknown band '{band}' in view '{view['name']}'! "
+                        + ("Bands must look like $B1." if file_ids is None else
+                           "Bands must look like " + ", ".join(f"${f}.B1" for f in file_ids))
+                    )
+            expressions.append(expression)
+
+        if 'cmap' in view:
+            try:
+                get_colormap_lut(view['cmap'])
+            except KeyError:
+                raise Exception(
+                    f"[CONFIG] Unknown cmap '{view['cmap']}' in view '{view['name']}'!"
+                )
+        return expressions
+
     def __getitem__(self, key):
         return self.config[key]
 
@@ -146,6 +284,14 @@ class Project:
         # create the project path and the user configuration path
         os.makedirs(self['path'], exist_ok=True)
         os.makedirs(join(self['path'], 'user_config'), exist_ok=True)
+        self.view_cache = FileCache(join(self['path'], 'cache', 'views'))
+        self.thumbnail_cache = FileCache(
+            join(self['path'], 'cache', 'thumbnails')
+        )
+        self.tile_cache = FileCache(join(self['path'], 'cache', 'tiles'))
+        self.bands_cache = FileCache(join(self['path'], 'cache', 'bands'))
+        self.feature_files = FileCache(join(self['path'], 'cache', 'features'))
+        self.band_stats = BandStatsStore(join(self['path'], 'band_stats'))
 
         # Make all paths absolute:
         self['images']['path'] = self.make_absolute(self['images']['path'])
@@ -160,37 +306,42 @@ class Project:
                 self['segmentation']['path']
             )
 
+        if self['images']['metadata_index']:
+            self.metadata_index = MetadataIndex(join(self['path'], 'metadata.db'))
+
+        # Finding all images can take long, hence we keep an index of them:
+        self.image_index = ImageIndex(join(self['path'], 'image_index.json'))
+        self.scan_images()
+
+    def scan_images(self, full=False):
+        """Update the image ids from the image index
+
+        Args:
+            full: If true, all image directories are searched again instead of
+                only the changed ones.
+        """
         if isinstance(self['images']['path'], dict):
-            image_paths = list(self['images']['path'].values())[0]
+            templates = list(self['images']['path'].values())
         else:
-            image_paths = self['images']['path']
-
-        # We will need to extract the image id by using regex. Compile it here
-        # to get a better perfomance:
-        before, id_str, after = image_paths.partition("{id}")
-        if not id_str:
-            raise Exception('[CONFIG] images:path must contain exactly one placeholder "{id}"!')
-        escaped_path = re.escape(before)
-        escaped_path += "(?P<id>.+)"
-        escaped_path += re.escape(after)
-        regex_images = re.compile(escaped_path)
-
-        images = glob(image_paths.format(id="*"))
-        if not images:
-            raise Exception(
-                f"[CONFIG] No images found in '{image_paths.format(id='*')}'.\n"
-                "Did you set images:path to a valid, existing path?")
+            templates = [self['images']['path']]
 
-        try:
-            self.image_ids = list(sorted([
-                regex_images.match(image_path).groups()[0]
-                for image_path in images
-            ]))
-        except Exception as error:
+        self.image_ids = self.image_index.scan(templates, full=full)
+        if not self.image_ids:
             raise Exception(
-                f'[ERROR] Could not extract id\nfrom path"{image_paths}"\nwith regex "{regex_images}"!'
-            )
+                "[CONFIG] No images found in '"
+                + "', '".join(t.format(id='*') for t in templates) + "'.\n"
+                "Did you set images:path to a valid, existing path?")
 
+        # Look-up table for the index of each image id in self.image_ids:
+        self._image_positions = {
+            image_id: i for i, image_id in enumerate(self.image_ids)
+        }
+        # The annotation counts and orders have to be renewed for the new
+        # images:
+        self.annotations.loaded = False
+        self.default_image_order = ImageOrder(self.image_ids, 0)
+        with self._image_orders_lock:
+            self._image_orders.clear()
 
     def make_absolute(self, path):
         """Make path absolute relatively from project path"""
@@ -212,20 +363,47 @@ class Project:
         return 'path' in self.config.get('segmentation', [])
 
     def get_start_image_id(self):
-        return self.image_ids[self.image_order[0]]
+        return self.default_image_order[0]
 
-    def load_image(self, filename, bands=None):
+    def load_image(self, filename, bands=None, window=None, out_shape=None):
         """Load image from file
 
+        Decoded images are kept in the image cache, so that switching between
+        views or predicting masks does not decode the same file over and over.
+
         Args:
             filename:
             bands: Defines which bands to load from file. Must be a list of
                 names starting with $, e.g. "$B1" or "$Sentinel2.B1"
+            window: Optional pixel window [xmin, ymin, xmax, ymax] (same
+                format as segmentation:mask_area). Only this part of the image
+                is read from GeoTIFFs/VRTs and memory-mapped npy files or band
+                directories.
+            out_shape: Optional maximum shape (height, width) of the returned
+                bands. Larger images are decimated while reading them. For
+                GeoTIFFs and VRTs, GDAL reads from their overviews if they
+                have some (see `iris overviews`).
 
         Returns:
             Returns a dictionary with the band names as keys and band array as
-            value.
+            value. The arrays are read-only.
         """
+        if filename.lower().endswith('npy') or isdir(filename):
+            # Memory-mapped files are already cached by the operating system:
+            return self._read_image(filename, bands, window, out_shape)
+
+        key = (
+            filename, None if bands is None else tuple(bands),
+            None if window is None else tuple(window),
+            None if out_shape is None else tuple(out_shape),
+            getmtime(filename)
+        )
+        data = self.image_cache.get_or_load(
+            key, lambda: self._read_image(filename, bands, window, out_shape)
+        )
+        return dict(data)
+
+    def _read_image(self, filename, bands=None, window=None, out_shape=None):
         # The user uses band identifiers (like 'B1', etc):
         if bands is not None:
             bands = list(map(
@@ -233,18 +411,63 @@ class Project:
                 bands
             ))
 
-        if filename.lower().endswith('npy'):
+        if window is not None:
+            xmin, ymin, xmax, ymax = window
+            window_slices = (slice(ymin, ymax), slice(xmin, xmax))
+        else:
+            window_slices = (slice(None), slice(None))
+
+        if isdir(filename):
+            # Band-major directory with one file per band (see `iris convert`),
+            # only the files of the requested bands are touched:
+            if bands is None:
+                bands = list(range(get_image_header(filename)[2]))
+            data = {}
+            for b in bands:
+                array = np.load(
+                    join(filename, f'B{b+1}.npy'), mmap_mode='r',
+                    allow_pickle=False
+                )
+                # Slicing the memory-mapped array does not read anything yet:
+                data[f'B{b+1}'] = decimate(array[window_slices], out_shape)
+            return data
+        elif filename.lower().endswith('npy'):
             array = np.load(filename, mmap_mode='r', allow_pickle=False)
-            if bands is not None:
-                array = array[..., bands]
+            if array.ndim == 2:
+                array = array[:, :, np.newaxis]
+            array = decimate(array[window_slices], out_shape)
+            if bands is None:
+                bands = list(range(array.shape[-1]))
+            # Views instead of fancy indexing, which would copy all bands:
+            return {f"B{b+1}": array[..., b] for b in bands}
         elif filename.lower().endswith(('vrt','tif','tiff')):
             with rio.open(filename) as file:
-                array = file.read([b+1 for b in bands]) if bands else file.read()
+                indexes = [b+1 for b in bands] if bands else list(file.indexes)
+                rio_window = Window.from_slices(
+                    *window_slices, height=file.height, width=file.width
+                )
+                size = (int(rio_window.height), int(rio_window.width))
+                steps = get_decimation_steps(size, out_shape)
+                if steps != [1, 1]:
+                    # Same shape as decimate gives for the other formats. GDAL
+                    # takes the best matching overview if there is one:
+                    array = file.read(indexes, window=rio_window, out_shape=(
+                        len(indexes),
+                        -(-size[0] // steps[0]),
+                        -(-size[1] // steps[1])
+                    ))
+                else:
+                    array = file.read(indexes, window=rio_window)
                 array = np.moveaxis(array, 0, -1)
         else:
-            array = imread(filename)
+            with PILImage.open(filename) as image:
+                mode = get_palette_mode(image)
+                array = np.asarray(image.convert(mode)) if mode else None
+            if array is None:
+                array = imread(filename)
             if len(array.shape) == 2:
                 array = array[:,:,np.newaxis]
+            array = decimate(array[window_slices], out_shape)
             if bands is not None:
                 array = array[..., bands]
 
@@ -257,13 +480,17 @@ class Project:
         }
         return data
 
-    def get_image(self, image_id, bands=None):
+    def get_image(self, image_id, bands=None, window=None, out_shape=None):
         """Get the image data as dictionary
 
         Args:
             image_id: Id of the image as string.
             bands: Bands of the image file (or files) to select, e.g. "$B1" or
                 "$Sentinel2.B1".
+            window: Optional pixel window [xmin, ymin, xmax, ymax] to read,
+                see load_image.
+            out_shape: Optional maximum shape (height, width) of the bands,
+                see load_image.
 
         Returns:
             A dict with bands. The keys are either "$B1"..."$Bn" or
@@ -285,13 +512,14 @@ class Project:
                         continue
 
                 image = self.load_image(
-                    filename.format(id=image_id), bands=file_bands
+                    filename.format(id=image_id), bands=file_bands,
+                    window=window, out_shape=out_shape
                 )
                 data[file_id] = image
         else:
             data = self.load_image(
                 self['images']['path'].format(id=image_id),
-                bands=bands
+                bands=bands, window=window, out_shape=out_shape
             )
             data = {
                 '$'+key: value
@@ -301,15 +529,29 @@ class Project:
         return data
 
     def get_image_bands(self, image_id):
-        # TODO: probably we could do this faster:
-        image = self.get_image(image_id)
+        """Get the names of all bands of an image
+
+        Only the file headers are read. Since all images of a project have the
+        same layout, the result is cached for each path template.
+
+        Returns:
+            A list of band names, e.g. ["$B1", "$B2"] or ["$Sentinel2.B1"].
+        """
+        if isinstance(self['images']['path'], dict):
+            templates = self['images']['path']
+        else:
+            templates = {None: self['images']['path']}
 
         bands = []
-        for band in image.keys():
-            if isinstance(image[band], dict):
-                bands.extend([f'${band}.{subband}' for subband in image[band]])
-            else:
-                bands.append(f'{band}')
+        for file_id, template in templates.items():
+            if template not in self._band_counts:
+                self._band_counts[template] = get_image_header(
+                    template.format(id=image_id)
+                )[2]
+            prefix = '$' if file_id is None else f'${file_id}.'
+            bands.extend(
+                f'{prefix}B{b+1}' for b in range(self._band_counts[template])
+            )
         return bands
 
     def get_image_path(self, image_id):
@@ -321,99 +563,436 @@ class Project:
         else:
             return self['images']['path'].format(id=image_id)
 
-    def render_image(self, image_id, view):
-        # Find all required variables
-        bands = re.findall('(?:\$\w+\.{0,1}\w+)', ";".join(view['data']))
-        image = self.get_image(image_id, bands=bands)
-        environment = self._get_render_environment(image)
+    def get_image_mtime(self, image_id):
+        """Get the latest modification time of the image file(s)"""
+        paths = self.get_image_path(image_id)
+        if isinstance(paths, dict):
+            return max(map(get_image_mtime, paths.values()))
+        return get_image_mtime(paths)
+
+    def get_view_file(self, image_id, view_name, encoding=None, timings=None):
+        """Get the filename of a rendered view, render it if necessary
+
+        The rendered views are cached as image files in the project directory.
+        They are identified by the image id, the modification time of the image
+        file(s), the view definition and the encoding, i.e. changing either of
+        them renders the view again.
+
+        Args:
+            image_id: Id of the image as string.
+            view_name: Name of the view as defined in the project config.
+            encoding: Optional format and options of the image file as
+                returned by iris.encoding.get_encoding. Default is the first
+                format of images:encoding.
+            timings: Optional dict. If the view is rendered, the durations of
+                rendering and encoding in seconds are stored in it.
+
+        Returns:
+            Filename of the image file.
+        """
+        view = self['views'][view_name]
+        if encoding is None:
+            encoding = get_encoding(self['images']['encoding'])
+        if timings is None:
+            timings = {}
+
+        key = json.dumps(
+            [
+                RENDER_VERSION, image_id, self.get_image_mtime(image_id),
+                self['images']['shape'], self['images']['decimate'], view,
+                encoding
+            ],
+            sort_keys=True, default=str
+        )
+        key = hashlib.sha1(key.encode()).hexdigest() + '.' + encoding['format']
+
+        def create():
+            start = time.perf_counter()
+            array = self.render_image(image_id, view)
+            timings['render'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            content = encode_image(array, encoding)
+            timings['encode'] = time.perf_counter() - start
+            return content
+
+        return self.view_cache.get_or_create(key, create)
+
+    def render_image(self, image_id, view, out_shape=None, window=None):
+        """Render a view of an image
+
+        Args:
+            image_id: Id of the image as string.
+            view: View definition from the project config.
+            out_shape: Optional maximum shape (height, width) of the rendered
+                image, e.g. for thumbnails. The bands are decimated while
+                reading them and stretched by their own statistics instead of
+                the stored band statistics.
+            window: Optional pixel window [xmin, ymin, xmax, ymax] to render,
+                e.g. for tiles. All channels are stretched by the statistics
+                of the whole image, so that neighbouring tiles match.
+
+        Returns:
+            The rendered image as uint8 array with shape HxWx3.
+        """
+        expressions = self.view_expressions[view['name']]
+        bands = self.get_view_bands(view['name'])
+        if window is not None:
+            stats = 'all'
+        elif out_shape is not None:
+            stats = 'none'
+        else:
+            stats = 'bands'
+            out_shape = self.get_render_shape()
+
+        image = self.get_image(
+            image_id, bands=bands, window=window, out_shape=out_shape
+        )
 
         rgb_bands = []
-        for i, expression_raw in enumerate(view['data']):
-            expression = re.sub(r'\$(\w+)\.(\w+)', r'\1["\2"]', expression_raw)
-            expression = re.sub(r'\$(\w+)', r'\1', expression)
+        for i, expression in enumerate(expressions):
             try:
-                # Since one should never rely on evaluating an expression from
-                # untrusted sources, we will have to find a different solution
-                # to make it safe.
-                self._check_band_expression(expression)
-                rgb_bands.append(
-                    eval(expression, {"__builtins__": None}, environment)
-                )
+                rgb_bands.append(expression(image))
             except Exception as error:
-                print(
-                    f"Could not parse {i}th expression of {view['name']}\n",
-                    f"Raw expression: {expression_raw}\n",
-                    f"Python expression: {expression}\n",
-                    f"Error: {error}\n",
-                    "Environment:"
+                raise Exception(
+                    f"Could not evaluate {i}th expression of {view['name']}: "
+                    f"{expression.expression}\nError: {error}"
                 )
-                pprint(environment)
 
-        # Broadcast (single numbers are converted to an array with the size of
-        # image)
-        image_size = project['images']['shape'][0] * project['images']['shape'][1]
+        # Single numbers are broadcast to the size of the image:
+        shapes = [band.shape for band in rgb_bands if not isinstance(band, Number)]
+        height, width = shapes[0] if shapes else self['images']['shape'][::-1]
+
+        # Monochrome images are quantised to indices of the colormap, RGB
+        # images straight to their colour values:
+        levels = 256 if len(rgb_bands) == 1 else 255
+        output = np.empty((height, width, len(rgb_bands)), dtype=np.uint8)
+        buffer = np.empty((height, width), dtype=np.float32)
         for i, band in enumerate(rgb_bands):
+            # Stretch between 0->1, with percentile clip if specified in view
+            vmin, vmax = self._get_stretch_bounds(
+                image_id, view, expressions[i], band, image, stats
+            )
+            scale = levels / (vmax - vmin) if vmax != vmin else 0
+
             if isinstance(band, Number):
-                band = np.repeat(band, image_size)
-                band = band.reshape(*project['images']['shape'])
+                output[..., i] = np.clip((band - vmin)*scale, 0, 255)
+                continue
+
+            np.subtract(band, vmin, out=buffer, dtype=np.float32)
+            np.multiply(buffer, scale, out=buffer)
+            np.clip(buffer, 0, 255, out=buffer)
+            output[..., i] = buffer
+
+        if len(rgb_bands) == 1:
+            return get_colormap_lut(view['cmap'])[output[..., 0]]
+        return output
+
+    def get_view_bands(self, view_name):
+        """Get the bands which are required by the expressions of a view"""
+        bands = []
+        for expression in self.view_expressions[view_name]:
+            bands.extend(b for b in expression.bands if b not in bands)
+        return bands
+
+    def get_bands_file(self, image_id, bands, dtype='auto', compress=False):
+        """Get a file with the raw bands of an image, create it if necessary
+
+        The bands are read like for the views and encoded with
+        iris.band_data.encode_bands. The files are cached like the views.
+
+        Args:
+            image_id: Id of the image as string.
+            bands: List of band names, e.g. ["$B1", "$B2"].
+            dtype: dtype of the stored bands, see encode_bands.
+            compress: If true, the file is compressed with gzip.
+
+        Returns:
+            Filename of the file.
+        """
+        out_shape = self.get_render_shape()
+        key = json.dumps(
+            [
+                image_id, self.get_image_mtime(image_id), bands, out_shape,
+                dtype, compress
+            ],
+            sort_keys=True, default=str
+        )
+        key = hashlib.sha1(key.encode()).hexdigest() + ('.gz' if compress else '.bin')
+
+        def create():
+            image = self.get_image(image_id, bands=bands, out_shape=out_shape)
+            content = encode_bands(
+                {band: get_band(image, band) for band in bands}, dtype
+            )
+            if compress:
+                content = gzip.compress(content, compresslevel=6)
+            return content
+
+        return self.bands_cache.get_or_create(key, create)
+
+    def get_image_size(self, image_id):
+        """Get the size (height, width) of an image in pixels
+
+        Only the header of the (first) image file is read.
+        """
+        if image_id not in self._image_sizes:
+            filenames = self.get_image_path(image_id)
+            if isinstance(filenames, dict):
+                filenames = list(filenames.values())
+            else:
+                filenames = [filenames]
+            self._image_sizes[image_id] = get_image_header(filenames[0])[:2]
+        return self._image_sizes[image_id]
+
+    def get_tile_file(self, image_id, view_name, z, x, y, encoding=None,
+                      timings=None):
+        """Get the filename of a map tile of a view, render it if necessary
 
-            rgb_bands[i] = band
+        The tiles form an XYZ pyramid over the full resolution image, see
+        iris.tiles. They are cached like the views.
 
-        # Stretch between 0->1, with percentile clip if specified in view
+        Args:
+            image_id: Id of the image as string.
+            view_name: Name of the view as defined in the project config.
+            z, x, y: Zoom level and position of the tile.
+            encoding: Optional format and options of the tile, see
+                get_view_file.
+            timings: Optional dict for the durations, see get_view_file.
+
+        Returns:
+            Filename of the image file or None if there is no such tile.
+        """
+        height, width = self.get_image_size(image_id)
+        tile = get_tile_window(height, width, z, x, y)
+        if tile is None:
+            return None
+        window, out_shape = tile
+
+        view = self['views'][view_name]
+        if encoding is None:
+            encoding = get_encoding(self['images']['encoding'])
+        if timings is None:
+            timings = {}
+
+        key = json.dumps(
+            [
+                RENDER_VERSION, image_id, self.get_image_mtime(image_id),
+                self['images']['decimate'], view, [z, x, y], encoding
+            ],
+            sort_keys=True, default=str
+        )
+        key = hashlib.sha1(key.encode()).hexdigest() + '.' + encoding['format']
+
+        def create():
+            start = time.perf_counter()
+            array = self.render_image(
+                image_id, view, out_shape=out_shape, window=window
+            )
+            timings['render'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            content = encode_image(array, encoding)
+            timings['encode'] = time.perf_counter() - start
+            return content
+
+        return self.tile_cache.get_or_create(key, create)
+
+    def prefetch_image(self, image_id, encoding=None, cancelled=None,
+                       segmentation=None):
+        """Render and cache all views and band statistics of an image
+
+        Args:
+            image_id: Id of the image as string.
+            encoding: Optional encoding of the views, see get_view_file.
+            cancelled: Optional threading.Event. If it is set, we stop after
+                the current step.
+            segmentation: Optional segmentation section of a user config. If
+                given, the inputs of the AI model are built as well.
+        """
+        bands = []
+        for view_name in self.view_expressions:
+            if cancelled is not None and cancelled.is_set():
+                return
+            self.get_view_file(image_id, view_name, encoding)
+            bands.extend(
+                b for b in self.get_view_bands(view_name) if b not in bands
+            )
+
+        if cancelled is not None and cancelled.is_set():
+            return
+        self.get_band_stats(image_id, bands)
+
+        if segmentation is None or (cancelled is not None and cancelled.is_set()):
+            return
+        if self.jobs.max_workers:
+            self.get_features_file(image_id, segmentation)
+        else:
+            self.get_features(image_id, segmentation)
+
+    def get_render_shape(self):
+        """Get the maximum shape (height, width) of the bands read for views"""
+        if self['images']['decimate']:
+            # There is no need to read more pixels than we display:
+            return self['images']['shape'][::-1]
+        return None
+
+    def _get_stretch_bounds(self, image_id, view, expression, band, image,
+                            stats='bands'):
+        """Get the values of a view channel which are stretched to 0 and 1
+
+        Args:
+            stats: Where the percentiles come from. 'none': computed from the
+                band. 'bands': channels which are scaled bands (e.g. "$B1*2")
+                take them from the band statistics, all others are computed
+                from the band. 'all': all channels take them from the
+                statistics of the whole image, the given band and image are
+                only a part of it.
+        """
         if 'clip' in view:
             if 'vmin' in view or 'vmax' in view:
                 raise ValueError("Cannot specify both 'clip' and 'vmin'/'vmax' in view")
             clip = float(view['clip'])
-            linear_scale = lambda z: np.clip(
-                (z - np.percentile(z,clip))/(np.percentile(z,100-clip)-np.percentile(z,clip)),
-                0,
-                1
-                )
-        elif 'vmin' in view or 'vmax' in view:
-            if 'vmin' in view and 'vmax' in view:
-                linear_scale = lambda z: np.clip((z - view['vmin'])/(view['vmax']-view['vmin']), 0, 1)
-            elif 'vmin' in view:
-                linear_scale = lambda z: np.clip((z - view['vmin'])/(z.max()-view['vmin']), 0, 1)
-            elif 'vmax' in view:
-                linear_scale = lambda z: np.clip((z - z.min())/(view['vmax']-z.min()), 0, 1)
+            percentiles = [clip, 100-clip]
+        else:
+            percentiles = [0, 100]
+
+        bounds = [view.get('vmin'), view.get('vmax')]
+        missing = [q for q, bound in zip(percentiles, bounds) if bound is None]
+        if not missing:
+            return bounds
+
+        if stats != 'none' and expression.affine is not None:
+            band_name, scale, offset = expression.affine
+            band_stats = self.get_band_stats(
+                image_id, [band_name], image if stats == 'bands' else None
+            )[band_name]
+            # A negative scale turns the percentiles upside down:
+            values = [
+                scale*get_percentile(band_stats, q if scale > 0 else 100-q) + offset
+                for q in missing
+            ]
+        elif stats == 'all':
+            expression_stats = self.get_expression_stats(image_id, expression)
+            values = [get_percentile(expression_stats, q) for q in missing]
         else:
-            linear_scale = lambda z: (z - z.min())/(z.max()-z.min())
-        rgb_bands = list(map(linear_scale, rgb_bands))
+            values = compute_percentiles(band, missing)
 
-        if len(rgb_bands) == 1:
-            rgb_bands = cm.get_cmap(view['cmap'])(rgb_bands)[..., :3]
+        values = iter(values)
+        return [next(values) if bound is None else bound for bound in bounds]
 
-        rgb_bands = np.dstack(rgb_bands)
-        return (255*rgb_bands).astype('uint8')
+    def get_expression_stats(self, image_id, expression):
+        """Get the statistics of a band expression for the whole image
 
-    def _get_render_environment(self, image):
-        return {
-            'max': np.max,
-            'max': np.min,
-            'mean': np.mean,
-            'median': np.median,
-            'log': np.log,
-            'exp': np.exp,
-            'sin': np.sin,
-            'cos': np.cos,
-            'PI': np.pi,
-            'edges': sobel,
-            'superpixels': felzenszwalb,
-            **{
-                key.strip('$'): value
-                for key, value in image.items()
-            },
-        }
+        They are stored together with the band statistics.
 
-    def _check_band_expression(self, expression):
-        forbidden_tokens = ['lambda', '__', 'except', 'eval', ';']
+        Args:
+            image_id: Id of the image as string.
+            expression: A compiled BandExpression.
+        """
+        out_shape = self.get_render_shape()
 
-        for forbidden in forbidden_tokens:
-            if forbidden in expression:
-                raise Exception(
-                    f"'{forbidden}' is not allowed in band expressions!\n"
-                    + f"Expression: {expression}"
-                )
+        def load(names):
+            image = self.get_image(
+                image_id, bands=expression.bands, out_shape=out_shape
+            )
+            return {expression.expression: expression(image)}
+
+        return self.band_stats.get(
+            image_id, [expression.expression],
+            [self.get_image_mtime(image_id), out_shape], load
+        )[expression.expression]
+
+    def get_band_stats(self, image_id, bands=None, image=None):
+        """Get the statistics of image bands
+
+        The statistics are computed only once and then stored in the project
+        directory (see `iris stats`).
+
+        Args:
+            image_id: Id of the image.
+            bands: List of band names, e.g. ["$B1"]. Default is all bands.
+            image: Optional image dictionary (see get_image) which already
+                contains the bands. Otherwise missing bands are loaded.
+
+        Returns:
+            A dict with the statistics per band, see
+            iris.band_stats.compute_band_stats.
+        """
+        if bands is None:
+            bands = self.get_image_bands(image_id)
+        out_shape = self.get_render_shape()
+
+        def load(missing):
+            data = image
+            if data is None:
+                data = self.get_image(image_id, bands=missing, out_shape=out_shape)
+            return {band: get_band(data, band) for band in missing}
+
+        return self.band_stats.get(
+            image_id, bands, [self.get_image_mtime(image_id), out_shape], load
+        )
+
+    def get_features(self, image_id, config):
+        """Get the inputs of the AI model for the mask area of an image
+
+        The inputs are kept in the feature cache, so that repeated predictions
+        for the same image do not read the image and build them again.
+
+        Args:
+            image_id: Id of the image.
+            config: segmentation section of the (user) config.
+
+        Returns:
+            A read-only float32 array with one row per pixel of the mask area,
+            see iris.features.build_features.
+        """
+        ai_model = config['ai_model']
+
+        def load():
+            image = self.get_image(
+                image_id, bands=ai_model['bands'], window=config['mask_area']
+            )
+            return build_features(image, ai_model)
+
+        return self.feature_cache.get_or_load(
+            self._get_feature_key(image_id, config), load
+        )
+
+    def get_features_file(self, image_id, config):
+        """Get a npy file with the inputs of the AI model, see get_features
+
+        The worker processes of the prediction jobs memory-map this file
+        instead of getting a copy of the inputs for each prediction. The
+        operating system keeps the pages of recently used files in memory.
+
+        Returns:
+            Filename of the file.
+        """
+        ai_model = config['ai_model']
+
+        def create():
+            image = self.get_image(
+                image_id, bands=ai_model['bands'], window=config['mask_area']
+            )
+            content = io.BytesIO()
+            np.save(content, build_features(image, ai_model), allow_pickle=False)
+            return content.getvalue()
+
+        key = hashlib.sha1(
+            json.dumps(self._get_feature_key(image_id, config)).encode()
+        ).hexdigest()
+        return self.feature_files.get_or_create(key + '.npy', create)
+
+    def _get_feature_key(self, image_id, config):
+        ai_model = config['ai_model']
+        return (
+            image_id, self.get_image_mtime(image_id), tuple(config['mask_area']),
+            json.dumps(
+                {option: ai_model[option] for option in FEATURE_OPTIONS},
+                sort_keys=True
+            )
+        )
 
     def get_metadata(self, image_id):
         filename = self['images'].get('metadata', False)
@@ -421,42 +1000,124 @@ class Project:
             return {}
 
         filename = filename.format(id=image_id)
+        if self.metadata_index is not None:
+            return self.metadata_index.get(image_id, filename)
 
-        with open(filename, 'r') as stream:
-            if filename.endswith('json'):
-                metadata = json.load(stream)
-            elif filename.endswith('yaml'):
-                metadata = yaml.safe_load(stream)
-            else:
-                return {"__body__": stream.read()}
+        return read_metadata(filename)
 
-        return metadata
+    def get_metadata_files(self):
+        """Get the metadata files of all images as dict"""
+        if not self['images']['metadata']:
+            return {}
+        return {
+            image_id: self['images']['metadata'].format(id=image_id)
+            for image_id in self.image_ids
+        }
 
-    def get_thumbnail(self, image_id):
-        filename = self['images'].get('thumbnails', False)
-        if not filename:
-            return None
+    def get_thumbnail_file(self, image_id, size=None, encoding=None,
+                           timings=None):
+        """Get the filename of a thumbnail, create it if necessary
 
-        return imread(filename.format(id=image_id))
+        Thumbnails are taken from the files in images:thumbnails. If there are
+        none, they are rendered from the view images:thumbnail_view with
+        decimated reads. The requested size is rounded up to one of
+        THUMBNAIL_SIZES and the results are cached in the project directory.
+
+        Args:
+            image_id: Id of the image as string.
+            size: Optional requested size (width, height). Default is the
+                largest thumbnail size.
+            encoding: Optional format and options of the image file as
+                returned by iris.encoding.get_encoding.
+            timings: Optional dict. If the thumbnail is created, the durations
+                of creating and encoding it in seconds are stored in it.
+
+        Returns:
+            Filename of the image file or None if there is no thumbnail.
+        """
+        size = get_thumbnail_size(size)
+        if encoding is None:
+            encoding = get_encoding(self['images']['encoding'])
+        if timings is None:
+            timings = {}
+
+        source = self['images']['thumbnails']
+        if source and exists(source.format(id=image_id)):
+            source = source.format(id=image_id)
+            source_version = [source, getmtime(source)]
+        else:
+            source = None
+            view = self['views'].get(self['images']['thumbnail_view'])
+            if view is None:
+                return None
+            source_version = [
+                RENDER_VERSION, self.get_image_mtime(image_id), view
+            ]
+
+        key = json.dumps(
+            [image_id, source_version, size, encoding],
+            sort_keys=True, default=str
+        )
+        key = hashlib.sha1(key.encode()).hexdigest() + '.' + encoding['format']
+
+        def create():
+            start = time.perf_counter()
+            if source is None:
+                # Thumbnails have the aspect ratio of images:shape:
+                width, height = self['images']['shape']
+                scale = size / max(width, height)
+                array = self.render_image(image_id, view, out_shape=(
+                    max(1, round(height*scale)), max(1, round(width*scale))
+                ))
+            else:
+                array = imread(source)
+            image = PILImage.fromarray(to_uint8(array))
+            image.thumbnail((size, size))
+            timings['thumbnail'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            content = encode_image(np.asarray(image), encoding)
+            timings['encode'] = time.perf_counter() - start
+            return content
+
+        return self.thumbnail_cache.get_or_create(key, create)
 
     def get_user_config(self, user_id):
+        """Get the project config merged with the config of a user
+
+        The merged configs are cached until the project or user config file
+        changes.
+
+        Returns:
+            The config as read-only dict (see iris.utils.freeze). Use
+            iris.utils.unfreeze to get a changeable copy.
+        """
         filename = join(self['path'], 'user_config', f'{user_id}.json')
-        config = deepcopy(self.config)
+        key = (
+            getmtime(self.file), getmtime(filename) if exists(filename) else None
+        )
+        cached = self._user_configs.get(str(user_id))
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        config = self.config
 
         # Only if the user config is newer the system's config file, we use it
         # for updates:
-        if exists(filename) and getmtime(self.file) <= getmtime(filename):
+        if key[1] is not None and key[0] <= key[1]:
             with open(filename, 'r') as stream:
                 user_config = json.load(stream)
 
             config = merge_deep_dicts(config, user_config)
             # Actually, it would be a security risk to allow some options to be
             # set by the user (or by a potential attacker):
-            config['images'] = deepcopy(self.config['images'])
-            config['views'] = deepcopy(self.config['views'])
+            config['images'] = self.config['images']
+            config['views'] = self.config['views']
             if "path" in self.config['segmentation']:
                 config['segmentation']['path'] = self.config['segmentation']['path']
 
+        config = freeze(config)
+        self._user_configs[str(user_id)] = (key, config)
         return config
 
     def save_user_config(self, user_id, user_config):
@@ -464,69 +1125,171 @@ class Project:
 
         with open(filename, 'w') as stream:
             json.dump(user_config, stream)
+        self._user_configs.pop(str(user_id), None)
+
+    def has_image(self, image_id):
+        return image_id in self._image_positions
+
+    def get_image_order(self, user):
+        """Get the personalised image order of a user
 
-    def get_next_image(self, image_id, user_id):
+        The orders are cached for the most recent users and regenerated from
+        the user's seed when needed.
+        """
+        with self._image_orders_lock:
+            order = self._image_orders.pop(user.id, None)
+            if order is None or order.seed != user.image_seed:
+                order = ImageOrder(self.image_ids, user.image_seed)
+            self._image_orders[user.id] = order
+
+            while len(self._image_orders) > MAX_IMAGE_ORDERS:
+                self._image_orders.popitem(last=False)
+        return order
+
+    def get_next_image(self, image_id, user, peek=False):
+        """Get the image which a user gets after image_id
 
-        original_index = self.image_ids.index(image_id)
-        index = self.image_order.index(original_index)
+        Args:
+            image_id: Id of the current image, must be an image of the project.
+            user: The user.
+            peek: If true, only look at the next image (e.g. to prefetch it)
+                without changing the user's order.
+        """
+        order = self.get_image_order(user)
 
-        # 'prioritise_unmarked_images' mode will search the database of existing
-        # masks, and find images with the lowest number of annotations to serve
-        # when a user asks for the next image. Then it will swap this image
-        # into the existing order to make it come up next.
+        # 'prioritise_unmarked_images' mode will use the annotation counts of
+        # existing masks, and find images with the lowest number of annotations
+        # to serve when a user asks for the next image. Then it will swap this
+        # image into the user's order to make it come up next.
         if self.config['segmentation']['prioritise_unmarked_images']:
-            from iris.models import Action
-            actions = Action.query.all()
-            # Same order as self.image_order (NOT self.image_ids)
-            mask_count = [0]*len(self.image_order)
-            mask_count[index] = 99999 # Make sure the current image isn't selected as the new one
-            for action in actions:
-                mask_count[
-                    self.image_order.index(
-                        self.image_ids.index(
-                            action.image_id
-                            )
-                            )
-                            ] += 1
-
-                if user_id.id == action.user_id:
-                    mask_count[
-                        self.image_order.index(
-                            self.image_ids.index(
-                                action.image_id
-                                )
-                                )
-                                ] += 9999
-
-            min_labellers = min(mask_count)
-            # iterate through images until one is found with fewest existing masks
-            next_image_found = False
-            trial_idx = index
-            while not next_image_found:
-                trial_idx = (trial_idx + 1) % len(self.image_order)
-                if mask_count[trial_idx] == min_labellers and trial_idx != index:
-                    # Once a suitable image is found, update the list so that its
-                    # next in line (this means self.get_previous_image retains expected
-                    # behaviour immediately afterwards).
-                    a = trial_idx
-                    b = (index + 1) % len(self.image_order)
-                    self.image_ids[self.image_order[a]], self.image_ids[self.image_order[b]] = \
-                        self.image_ids[self.image_order[b]], self.image_ids[self.image_order[a]]
-                    next_image_found = True
-        index = (index + 1) % len(self.image_order)
-        return self.image_ids[self.image_order[index]]
-
-    def get_previous_image(self, image_id):
-        original_index = self.image_ids.index(image_id);
-
-        index = self.image_order.index(original_index)
-        index = (index - 1) % len(self.image_order)
-        return self.image_ids[self.image_order[index]]
-
-    def set_image_seed(self, seed):
-        self.random_state = np.random.RandomState(seed=seed)
-        self.image_order = list(range(len(self.image_ids)))
-
-        self.random_state.shuffle(self.image_order)
+            if not self.annotations.loaded:
+                self.annotations.load(self.image_ids)
+
+            next_image_id = self.annotations.get_least_annotated(
+                user.id,
+                following_images=order.following(image_id),
+                distance=lambda other_id: order.distance(image_id, other_id),
+                exclude={image_id}
+            )
+            if next_image_id is not None and peek:
+                return next_image_id
+            if next_image_id is not None:
+                # Once a suitable image is found, update the order so that its
+                # next in line (this means self.get_previous_image retains expected
+                # behaviour immediately afterwards).
+                order.swap(next_image_id, order.next(image_id))
+
+        return order.next(image_id)
+
+    def get_previous_image(self, image_id, user):
+        return self.get_image_order(user).previous(image_id)
+
+@functools.lru_cache(maxsize=None)
+def get_colormap_lut(name):
+    """Get a matplotlib colormap as lookup table
+
+    Returns:
+        An uint8 array with shape 256x3. Each row is the RGB colour of the
+        colormap for one of 256 equally spaced values between 0 and 1.
+    """
+    colours = matplotlib.colormaps[name]((np.arange(256) + 0.5) / 256)
+    lut = (255*colours[:, :3]).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
+def get_thumbnail_size(size):
+    """Round a requested thumbnail size (width, height) up to THUMBNAIL_SIZES"""
+    if size is None:
+        return THUMBNAIL_SIZES[-1]
+    for bucket in THUMBNAIL_SIZES:
+        if bucket >= max(size):
+            return bucket
+    return THUMBNAIL_SIZES[-1]
+
+
+def to_uint8(array):
+    """Convert an image array to uint8, float arrays must be between 0 and 1"""
+    if issubclass(array.dtype.type, np.floating):
+        return np.clip(array * 255., 0, 255).astype(np.uint8)
+    return array.astype(np.uint8, copy=False)
+
+
+def get_band_files(dirname):
+    """Get the files of a band directory in the order of their bands"""
+    count = sum(
+        1 for name in os.listdir(dirname) if re.fullmatch(r'B\d+\.npy', name)
+    )
+    return [join(dirname, f'B{b+1}.npy') for b in range(count)]
+
+
+def get_image_mtime(filename):
+    """Get the modification time of an image file or band directory"""
+    if isdir(filename):
+        return max(map(getmtime, get_band_files(filename)))
+    return getmtime(filename)
+
+
+def read_npy_shape(filename):
+    """Read the shape of an array from the header of a npy file"""
+    with open(filename, 'rb') as stream:
+        version = np.lib.format.read_magic(stream)
+        if version == (1, 0):
+            return np.lib.format.read_array_header_1_0(stream)[0]
+        return np.lib.format.read_array_header_2_0(stream)[0]
+
+
+def get_image_header(filename):
+    """Get the height, width and number of bands of an image file
+
+    Only the header of the file is read.
+    """
+    if isdir(filename):
+        files = get_band_files(filename)
+        if not files:
+            raise Exception(f'Band directory {filename} contains no B1.npy!')
+        shape = read_npy_shape(files[0])
+        return shape[0], shape[1], len(files)
+    elif filename.lower().endswith('npy'):
+        shape = read_npy_shape(filename)
+        return shape[0], shape[1], shape[-1] if len(shape) > 2 else 1
+    elif filename.lower().endswith(('vrt','tif','tiff')):
+        with rio.open(filename) as file:
+            return file.height, file.width, file.count
+    else:
+        with PILImage.open(filename) as image:
+            mode = get_palette_mode(image)
+            return image.height, image.width, len(mode or image.getbands())
+
+def get_palette_mode(image):
+    """Get the mode (RGB or RGBA) to which a palette image is expanded
+
+    Args:
+        image: An opened PIL image.
+
+    Returns:
+        The mode or None if the image has no palette.
+    """
+    if image.mode not in ('P', 'PA'):
+        return None
+    if image.mode == 'PA' or 'transparency' in image.info \
+            or image.palette.mode == 'RGBA':
+        return 'RGBA'
+    return 'RGB'
+
+def decimate(array, out_shape):
+    """Take every n-th pixel so that the array is not larger than out_shape"""
+    steps = get_decimation_steps(array.shape[:2], out_shape)
+    return array[::steps[0], ::steps[1]]
+
+
+def get_decimation_steps(shape, out_shape):
+    """Get the integer steps (rows, columns) to decimate an image of shape"""
+    if out_shape is None:
+        return [1, 1]
+    return [
+        max(1, int(np.ceil(size / max_size)))
+        for size, max_size in zip(shape, out_shape)
+    ]
 
 project = Project()
@@ -7,22 +7,24 @@ from os.path import basename, dirname, exists, join
 import time
 from pprint import pprint
 
-import lightgbm as lgb
 import flask
 import numpy as np
 import rasterio as rio
 from rasterio.io import MemoryFile
-from scipy.ndimage import convolve, minimum_filter, maximum_filter
+from rasterio.windows import Window, transform as window_transform
+from scipy.ndimage import minimum_filter, maximum_filter
 from skimage.io import imread, imsave
-from skimage.filters import sobel
-from skimage.segmentation import felzenszwalb
-from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, f1_score, jaccard_score
 import yaml
 
+from iris.encoding import get_encoding
+from iris.jobs import JobCancelled, QueueFull
+from iris.model_store import encode_labels
+from iris.prediction import fit_and_predict
 from iris.user import requires_auth
 from iris.models import db, User, Action
 from iris.project import project
+from iris.utils import unfreeze
 
 segmentation_app = flask.Blueprint(
     'segmentation', __name__,
@@ -45,11 +47,29 @@ def index():
                 .order_by(Action.last_modification.desc()) \
                 .first()
 
-            if last_mask is not None:
+            # The image may have been removed from the project since then:
+            if last_mask is not None and project.has_image(last_mask.image_id):
                 image_id = last_mask.image_id
-    elif image_id not in project.image_ids:
+    elif not project.has_image(image_id):
         return flask.make_response('Unknown image id!', 404)
 
+    user_id = flask.session.get('user_id', None)
+    user = User.query.get(user_id) if user_id else None
+    if user is not None:
+        # Prepare the next image while the user works on this one:
+        next_image_id = project.get_next_image(image_id, user, peek=True)
+        encoding = get_encoding(
+            project['images']['encoding'],
+            accept=flask.request.accept_mimetypes
+        )
+        segmentation = project.get_user_config(user.id)['segmentation']
+        project.prefetcher.schedule(
+            user.id, next_image_id,
+            lambda image_id, cancelled: project.prefetch_image(
+                image_id, encoding, cancelled, segmentation
+            )
+        )
+
     metadata = project.get_metadata(image_id)
     return flask.render_template(
         'segmentation.html',
@@ -61,7 +81,6 @@ def index():
 @requires_auth
 def next_image():
     user = User.query.get(flask.session['user_id'])
-    project.set_image_seed(user.image_seed)
 
     image_id = project.get_next_image(
         flask.request.args.get('image_id', project.get_start_image_id()),
@@ -76,10 +95,10 @@ def next_image():
 @requires_auth
 def previous_image():
     user = User.query.get(flask.session['user_id'])
-    project.set_image_seed(user.image_seed)
 
     image_id = project.get_previous_image(
-        flask.request.args.get('image_id', project.get_start_image_id())
+        flask.request.args.get('image_id', project.get_start_image_id()),
+        user
     )
 
     return flask.redirect(
@@ -165,6 +184,7 @@ def merge_masks(image_id, complete=False):
             ).first()
         if not action:
             action = Action(user=user, image_id=image_id, type="segmentation")
+            project.annotations.add(image_id, user.id)
 
         if len(users) == 2:
             # Just check how much the user agrees with the other one:
@@ -312,17 +332,18 @@ def align_mask_to_input(mask_file, input_file):
 
         # If the mask is a GeoTIFF, we need to align its metadata with the input file
 
-        # 1. Open the mask file to read its metadata
+        # 1. Open the input file to read its metadata (no pixels are read)
         with rio.open(input_file, 'r') as input_src:
             profile = input_src.profile.copy()
             transform = input_src.transform
+            crs = input_src.crs
 
-        # 2. Calculate mask's geographic extent based on project config
-        mask_area = project.config['segmentation']['mask_area'] # [xmin, ymin, xmax, ymax] pixel-space
-
-        # Calculate geographic coordinates from pixel coordinates, and other metadata
-        xmin, ymin = transform * (mask_area[0], mask_area[1])
-        xmax, ymax = transform * (mask_area[2], mask_area[3])
+        # 2. The mask covers the same pixel window of the input as the one
+        # read by predict_mask ([xmin, ymin, xmax, ymax] pixel-space):
+        mask_area = project.config['segmentation']['mask_area']
+        window = Window.from_slices(
+            (mask_area[1], mask_area[3]), (mask_area[0], mask_area[2])
+        )
 
         width = mask_area[2] - mask_area[0]
         height = mask_area[3] - mask_area[1]
@@ -332,11 +353,8 @@ def align_mask_to_input(mask_file, input_file):
         # 3. Update the profile with the new geographic extent
         profile.update({
             # This is the way we get the mask's geographic position within the original image's
-            "transform": rio.Affine(
-                (xmax - xmin) / width, 0, xmin,
-                0, (ymax - ymin) / height, ymin
-            ),
-            "crs": input_src.crs,
+            "transform": window_transform(window, transform),
+            "crs": crs,
             "driver": 'GTiff',
             "count": count,  # Number of bands in the mask
             "height": height,
@@ -438,6 +456,7 @@ def save_mask(image_id):
         .first()
     if not action:
         action = Action(user=user, image_id=image_id, type="segmentation")
+        project.annotations.add(image_id, user.id)
     action.last_modification = datetime.utcnow()
     db.session.add(action)
     db.session.commit()
@@ -447,115 +466,119 @@ def save_mask(image_id):
     # We need this to send a successful response to the client
     return flask.make_response('Masks successfully saved!')
 
-def image_dict_to_array(image_dict):
-    if isinstance(image_dict, np.ndarray):
-        return image_dict
-
-    return np.dstack(
-        [image_dict_to_array(v) for v in image_dict.values()]
-    )
-
 @segmentation_app.route('/predict_mask/<image_id>', methods=['POST'])
 @requires_auth
 def predict_mask(image_id):
-    config = project.get_user_config(flask.session['user_id'])
-    config = config['segmentation']
+    """Submit a prediction job for the mask of an image
 
-    print('Fit options:', config)
-
-    # How to exclude certain bands?
-    image_dict = project.get_image(image_id, bands=config['ai_model']['bands'])
-    image = image_dict_to_array(image_dict)
+    Training the model takes too long for a request, hence only the id of the
+    job is returned (see iris.jobs). Its result can be fetched from
+    /prediction/<job_id>. A previous job of the user is cancelled.
+    """
+    if not project.has_image(image_id):
+        return flask.make_response('Unknown image id!', 404)
 
-    n_channels = image.shape[-1]
+    user_id = flask.session['user_id']
+    config = project.get_user_config(user_id)
+    config = config['segmentation']
 
-    # Select only the masking area:
-    mask_area = (
-        slice(config['mask_area'][1], config['mask_area'][3]),
-        slice(config['mask_area'][0], config['mask_area'][2]),
-        slice(None, None, None)
-    )
-    mask_size = config['mask_shape'][0] * config['mask_shape'][1]
-    image = image[mask_area]
+    print('Fit options:', config)
 
     data = json.loads(flask.request.data)
-    user_indices = np.array(data['user_pixels'])
-    user_labels = np.array(data['user_labels'])
-
-    inputs = [image]
-    if config['ai_model']['use_edge_filter']:
-        edges = np.dstack([
-            sobel(image[..., i])
-            for i in range(n_channels)
-        ])
-        inputs.append(edges)
-
-    if config['ai_model']['use_meshgrid']:
-        if config['ai_model']['meshgrid_cells'] == "pixelwise":
-            x_size, y_size = image.shape[0], image.shape[1]
-        else:
-            x_size, y_size = map(int, config['ai_model']['meshgrid_cells'].split('x'))
-        y_size = 3
-        x = np.repeat(np.arange(x_size), int(image.shape[0]/x_size)+1)
-        y = np.repeat(np.arange(y_size), int(image.shape[1]/y_size)+1)
-        x_grid, y_grid = np.meshgrid(x[:image.shape[0]], y[:image.shape[1]])
-        inputs.append(x_grid[..., np.newaxis])
-        inputs.append(y_grid[..., np.newaxis])
-
-    if config['ai_model']['use_superpixels']:
-        super_pixels = felzenszwalb(
-            image, scale=image.shape[0]/5, sigma=4, min_size=100
+    user_indices = np.array(data['user_pixels'], dtype=int)
+    user_labels = np.array(data['user_labels'], dtype=int)
+    if len(user_indices) != len(user_labels) or len(np.unique(user_labels)) < 2:
+        return flask.make_response(
+            'Need one label per pixel and at least two classes!', 400
         )
-        inputs.append(super_pixels)
+    # The labelled pixels are subsampled, the same seed gives the same mask:
+    seed = int(data.get('seed', 42))
 
-    inputs = np.dstack(inputs).reshape(mask_size, -1)
+    try:
+        job = project.jobs.submit(
+            user_id, run_prediction, image_id, config, user_indices,
+            user_labels, seed
+        )
+    except QueueFull as error:
+        response = flask.make_response(str(error), 429)
+        response.headers.set('Retry-After', '2')
+        return response
 
-    train_indices, val_indices, train_labels, val_labels = train_test_split(
-        user_indices, user_labels, stratify=user_labels,
-        test_size=0.3, random_state=42
-    )
+    return flask.make_response(flask.jsonify(job.to_dict()), 202)
 
-    gbm = lgb.LGBMClassifier(
-        num_leaves=config['ai_model']['n_leaves'],
-        max_bin=128,
-        max_depth=config['ai_model']['max_depth'],
-        # min_data_in_leaf=1000,
-        # bagging_fraction=0.2,
-        # boosting_type='dart',
-        tree_learner='data',
-        learning_rate=0.05,
-        n_estimators=config['ai_model']['n_estimators'],
-        n_jobs=10,
-    )
-    early_stopping = lgb.early_stopping(4, verbose=False)
-    gbm.fit(
-        inputs[train_indices, :], train_labels,
-        eval_set=[(inputs[val_indices, :], val_labels)],
-        callbacks=[early_stopping]
-    )
+@segmentation_app.route('/prediction/<job_id>', methods=['GET'])
+@requires_auth
+def prediction(job_id):
+    """Get the status of a prediction job or the predicted mask
 
-    # predict the mask for the whole image:
-    predictions = gbm.predict(
-        inputs, num_iteration=gbm.best_iteration_
+    Returns the job as JSON with status code 202 while it is queued or
+    running. Once it is done, the predicted classes of the mask are sent as
+    bytes (one uint8 per pixel).
+    """
+    job = project.jobs.get(job_id)
+    if job is None or job.owner != flask.session['user_id']:
+        return flask.make_response('Unknown or superseded job!', 404)
+
+    if job.status == 'done':
+        response = flask.make_response(job.result.tobytes())
+        response.headers.set('Content-Type', 'application/octet-stream')
+        return response
+    elif job.status == 'failed':
+        return flask.make_response(f'Could not predict the mask: {job.error}', 500)
+    elif job.status == 'cancelled':
+        return flask.make_response('The job was cancelled!', 409)
+
+    return flask.make_response(flask.jsonify(job.to_dict()), 202)
+
+def run_prediction(job, image_id, config, user_indices, user_labels, seed):
+    """Predict the mask of an image, runs as job of project.jobs"""
+    # The inputs only depend on the image, not on the labels, hence they are
+    # cached between the predictions for the same image. The worker processes
+    # memory-map them from a file instead of getting a copy:
+    if project.jobs.max_workers:
+        inputs = project.get_features_file(image_id, config)
+    else:
+        inputs = project.get_features(image_id, config)
+    # Building the inputs takes a while, the user may have pressed the button
+    # again in the meantime:
+    if job.cancelled.is_set():
+        raise JobCancelled()
+
+    # Continue training the last model of the user if the labels have changed
+    # only a bit:
+    ai_model = unfreeze(config['ai_model'])
+    options = json.dumps(
+        [ai_model, config['mask_area'], seed], sort_keys=True, default=str
     )
-    predictions = predictions.astype(np.uint8)
-
-    # Apply suppression filter:
-    if config['ai_model']['suppression_threshold'] != 0:
-        other_classes = (predictions != config['ai_model']['suppression_default_class']).astype(int)
-        other_classes = other_classes.reshape(*config['mask_shape'])
-        window_size = config['ai_model']['suppression_filter_size']
-        window = np.ones((window_size, window_size))
-        window[window_size//2, window_size//2] = 0
-        neighbourhood_ratio = convolve(
-            other_classes, window, mode='constant', cval=0.5
-        ) / (window_size**2 - 1)
-        suppress = 100 * neighbourhood_ratio.ravel() < config['ai_model']['suppression_threshold']
-        predictions[suppress] = config['ai_model']['suppression_default_class']
-
-    # Return the results:
-    response = flask.make_response(
-        predictions.tobytes()
+    codes = encode_labels(user_indices, user_labels)
+    init_model = project.models.get_init_model(
+        job.owner, image_id, options, codes, ai_model
     )
-    response.headers.set('Content-Type', 'application/octet-stream')
-    return response
+
+    # Concurrent predictions share the CPU instead of oversubscribing it:
+    with project.cpu_budget.acquire() as n_threads:
+        predictions, model, n_iterations = project.jobs.run_in_process(
+            job, fit_and_predict, inputs, user_indices, user_labels,
+            ai_model, config['mask_shape'], n_threads, seed,
+            None if init_model is None else init_model['model']
+        )
+
+    if not job.cancelled.is_set():
+        project.models.put(job.owner, image_id, {
+            'model': model,
+            'n_iterations': n_iterations,
+            'options': options,
+            'codes': codes,
+        })
+    return predictions
+
+@segmentation_app.route('/drop_model/<image_id>', methods=['POST'])
+@requires_auth
+def drop_model(image_id):
+    """Forget the AI model of the user for an image
+
+    The next prediction trains a new model from scratch, e.g. after the user
+    has reset the mask.
+    """
+    n_models = project.models.drop(flask.session['user_id'], image_id)
+    return flask.make_response(f'Dropped {n_models} model(s).')
@@ -862,6 +862,9 @@ function dialogue_reset_mask() {
 }
 
 function reset_mask() {
+    // The AI should not continue training on the old labels:
+    fetch(vars.url.segmentation + "drop_model/" + vars.image_id, {method: "POST"});
+
     vars.mask = new Uint8Array(vars.mask_shape[1] * vars.mask_shape[0]);
     vars.user_mask = new Uint8Array(vars.mask_shape[1] * vars.mask_shape[0]);
 
@@ -1453,9 +1456,31 @@ async function predict_mask() {
             })
         }
     );
+    if (results.response.status == 429) {
+        hide_loader();
+        show_dialogue(
+            "warning",
+            "<p>The server is busy with the AI of other users. Please try again in a few seconds.</p>"
+        )
+        return;
+    }
+
+    // The model is trained in the background, we poll for the result:
+    if (results.response.status == 202) {
+        let job_url = vars.url.segmentation + "prediction/" + results.data.id;
+        do {
+            await new Promise(resolve => setTimeout(resolve, 250));
+            results = await download(job_url);
+            if (results.response.status == 202 && results.data.status == "queued") {
+                show_loader("Wait for a free AI worker...");
+            } else if (results.response.status == 202) {
+                show_loader("Train AI...");
+            }
+        } while (results.response.status == 202);
+    }
 
     show_loader("Process results...");
-    if (results.response.status >= 500) {
+    if (results.response.status >= 400) {
         hide_loader();
         console.log("Could not predict the mask! Code: " + results.response.status);
         show_dialogue(
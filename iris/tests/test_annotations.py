@@ -0,0 +1,43 @@
+import pytest
+
+import iris.annotations
+from iris.annotations import AnnotationCounts
+
+
+def make_counts(counts):
+    annotations = AnnotationCounts()
+    annotations.counts = {}
+    for image_id in counts:
+        annotations.counts[image_id] = 0
+        annotations.buckets[0].add(image_id)
+    annotations.loaded = True
+    for image_id, count in counts.items():
+        for user_id in range(count):
+            annotations.add(image_id, user_id)
+    return annotations
+
+
+@pytest.mark.parametrize('small_bucket_size', [0, 1000])
+def test_least_annotated_image_follows_order(monkeypatch, small_bucket_size):
+    monkeypatch.setattr(iris.annotations, 'SMALL_BUCKET_SIZE', small_bucket_size)
+    order = ['a', 'b', 'c', 'd', 'e']
+    annotations = make_counts({'a': 1, 'b': 2, 'c': 0, 'd': 1, 'e': 0})
+
+    def find(user_id, current):
+        index = order.index(current)
+        return annotations.get_least_annotated(
+            user_id,
+            following_images=(order[(index+i) % 5] for i in range(1, 5)),
+            distance=lambda image_id: (order.index(image_id) - index) % 5,
+            exclude={current}
+        )
+
+    assert find(user_id=5, current='a') == 'c'
+    assert find(user_id=5, current='c') == 'e'
+    assert find(user_id=5, current='e') == 'c'
+
+    # Images annotated by the user are skipped:
+    annotations.add('c', 5)
+    annotations.add('e', 5)
+    assert find(user_id=5, current='b') == 'd'
+    assert annotations.counts == {'a': 1, 'b': 2, 'c': 1, 'd': 1, 'e': 1}
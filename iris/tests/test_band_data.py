@@ -0,0 +1,38 @@
+import json
+import struct
+
+import numpy as np
+
+from iris.band_data import encode_bands
+
+
+def decode(content):
+    length = struct.unpack('<I', content[:4])[0]
+    header = json.loads(content[4:4+length])
+    assert (4 + length) % 8 == 0
+    data = np.frombuffer(content[4+length:], dtype='<' + np.dtype(header['dtype']).str[1:])
+    data = data.reshape(len(header['bands']), header['height'], header['width'])
+    return header, {
+        band['name']: band['offset'] + band['scale'] * data[i].astype(float)
+        for i, band in enumerate(header['bands'])
+    }
+
+
+def test_encode_bands():
+    small = np.arange(12, dtype=np.uint16).reshape(3, 4)
+    header, bands = decode(encode_bands({'$B1': small}))
+    assert header['dtype'] == 'uint8'
+    assert np.array_equal(bands['$B1'], small)
+
+    large = small * 1000 - 5000
+    header, bands = decode(encode_bands({'$B1': small, '$B2': large}))
+    assert header['dtype'] == 'uint16'
+    assert np.allclose(bands['$B2'], large, atol=1)
+
+    reflectance = np.linspace(0, 1, 12, dtype=np.float32).reshape(3, 4)
+    header, bands = decode(encode_bands({'$B1': reflectance}))
+    assert header['dtype'] == 'float16'
+    assert np.allclose(bands['$B1'], reflectance, atol=1e-3)
+
+    header, bands = decode(encode_bands({'$B1': reflectance}, dtype='uint8'))
+    assert np.allclose(bands['$B1'], reflectance, atol=1/255)
@@ -0,0 +1,14 @@
+import numpy as np
+
+from iris.project import get_band_files, get_image_header
+
+
+def test_band_directory(tmp_path):
+    for b in range(3):
+        np.save(tmp_path / f'B{b+1}.npy', np.full((20, 30), b, dtype=np.uint16))
+    (tmp_path / 'notes.txt').write_text('not a band')
+
+    assert get_band_files(str(tmp_path)) == [
+        str(tmp_path / f'B{b+1}.npy') for b in range(3)
+    ]
+    assert get_image_header(str(tmp_path)) == (20, 30, 3)
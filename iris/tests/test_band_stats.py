@@ -0,0 +1,37 @@
+import numpy as np
+
+from iris.band_stats import BandStatsStore, get_percentile
+from iris.expressions import BandExpression
+
+
+def test_band_stats_store(tmp_path):
+    band = np.random.RandomState(0).normal(size=(50, 40)).astype(np.float32)
+    loaded = []
+
+    def load(bands):
+        loaded.extend(bands)
+        return {b: band for b in bands}
+
+    store = BandStatsStore(str(tmp_path))
+    stats = store.get('image', ['$B1'], [1., None], load)['$B1']
+
+    assert stats['min'] == band.min() and stats['max'] == band.max()
+    assert stats['histogram'].sum() == band.size
+    assert np.isclose(get_percentile(stats, 2), np.percentile(band, 2))
+
+    # The statistics are taken from disk, unless the version has changed:
+    store = BandStatsStore(str(tmp_path))
+    store.get('image', ['$B1'], [1., None], load)
+    assert loaded == ['$B1']
+    store.get('image', ['$B1'], [2., None], load)
+    assert loaded == ['$B1', '$B1']
+
+
+def test_band_expression_detects_affine_expressions():
+    assert BandExpression("$B1").affine == ('$B1', 1., 0.)
+    assert BandExpression("-($S2.B3*2 + 1)/4").affine == ('$S2.B3', -0.5, -0.25)
+    assert BandExpression("$B1*2**3").affine == ('$B1', 8., 0.)
+    assert BandExpression("$B1**2").affine is None
+    assert BandExpression("$B1-$B2").affine is None
+    assert BandExpression("edges($B1)").affine is None
+    assert BandExpression("$B1*0").affine is None
@@ -0,0 +1,45 @@
+import numpy as np
+
+from iris.cache import ArrayCache, FileCache
+
+
+def test_array_cache_evicts_least_recently_used():
+    cache = ArrayCache(max_bytes=2*800)
+    cache.put('a', np.zeros(100))
+    cache.put('b', np.zeros(100))
+    assert cache.get('a') is not None
+    cache.put('c', np.zeros(100))
+
+    assert 'a' in cache and 'c' in cache
+    assert 'b' not in cache
+    assert cache.current_bytes == 2*800
+    assert cache.stats()['hits'] == 1
+
+
+def test_array_cache_values_are_read_only():
+    cache = ArrayCache(max_bytes=10_000)
+    value = cache.get_or_load('a', lambda: {'B1': np.zeros(10)})
+    assert not value['B1'].flags.writeable
+    assert cache.get_or_load('a', lambda: None) is value
+    assert cache.stats()['misses'] == 1
+
+
+def test_array_cache_skips_too_large_values():
+    cache = ArrayCache(max_bytes=10)
+    cache.put('a', np.zeros(100))
+    assert len(cache) == 0
+
+
+def test_file_cache_creates_files_only_once(tmp_path):
+    cache = FileCache(str(tmp_path))
+    calls = []
+
+    def creator():
+        calls.append(1)
+        return b'content'
+
+    filename = cache.get_or_create('abc.png', creator)
+    assert cache.get_or_create('abc.png', creator) == filename
+    with open(filename, 'rb') as stream:
+        assert stream.read() == b'content'
+    assert len(calls) == 1
@@ -0,0 +1,54 @@
+import threading
+
+from iris.cpu_budget import CPUBudget
+
+
+def run_concurrently(budget, n_tasks):
+    """Acquire the budget in n_tasks threads which all hold it at once"""
+    running = []
+    # All tasks must be inside acquire() at the same time to pass the
+    # barrier, otherwise it breaks after the timeout:
+    all_running = threading.Barrier(
+        n_tasks, action=lambda: running.append(budget.stats()['running']),
+        timeout=10
+    )
+    shares = []
+
+    def task():
+        with budget.acquire() as share:
+            shares.append(share)
+            all_running.wait()
+
+    threads = [threading.Thread(target=task) for _ in range(n_tasks)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not all_running.broken
+    assert running == [n_tasks]
+    return shares
+
+
+def test_cpu_budget():
+    budget = CPUBudget(8, max_tasks=3)
+
+    # A lone task gets all threads:
+    assert run_concurrently(budget, 1) == [8]
+
+    # The second task gets what is left, but at least one thread:
+    assert run_concurrently(budget, 2) == [8, 1]
+
+    # Once the first task has finished, the next one shares fairly with the
+    # second task:
+    first, second, third = budget.acquire(), budget.acquire(), budget.acquire()
+    assert first.__enter__() == 8
+    assert second.__enter__() == 1
+    first.__exit__(None, None, None)
+    assert third.__enter__() == 4
+    second.__exit__(None, None, None)
+    third.__exit__(None, None, None)
+
+    stats = budget.stats()
+    assert stats['used_threads'] == 0 and stats['running'] == 0
+    assert stats['tasks'] == 6
@@ -29,3 +29,25 @@ class TestCore:
             if response.status_code == 405:
                 response = requests.post(address, {})
             assert response.status_code == 403
+
+    def test_invalid_encoding(self):
+        for args in [
+            'format=png&compress_level=42', 'format=webp&quality=500', 'format=jpeg&quality=-3',
+            'format=gif',
+        ]:
+            response = requests.get(self.url('image/coast/RGB?' + args))
+            assert response.status_code == 400, args
+        response = requests.get(self.url('image/coast/RGB?format=png&compress_level=9'))
+        assert response.status_code == 200
+
+    def test_invalid_thumbnail_size(self):
+        for size in ['abc', '0x10', '-5x10', '64', '64x64x64']:
+            response = requests.get(self.url('thumbnail/coast?size=' + size))
+            assert response.status_code == 400, size
+        response = requests.get(self.url('thumbnail/coast?size=50x50'))
+        assert response.status_code == 200
+
+    def test_unknown_image(self):
+        for address in ['image/nonexist/RGB', 'thumbnail/nonexist']:
+            response = requests.get(self.url(address))
+            assert response.status_code == 404, address
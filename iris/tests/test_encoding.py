@@ -0,0 +1,51 @@
+import pytest
+from werkzeug.datastructures import MIMEAccept
+
+from iris.encoding import get_encoding
+
+CONFIG = {
+    'formats': ['webp', 'png'],
+    'png_compress_level': 1,
+    'webp_lossless': True,
+    'webp_quality': 90,
+    'jpeg_quality': 90,
+}
+
+
+def test_get_encoding_negotiates_format():
+    webp = MIMEAccept([('image/webp', 1), ('*/*', 0.8)])
+    assert get_encoding(CONFIG, accept=webp)['format'] == 'webp'
+    png = MIMEAccept([('image/png', 1)])
+    assert get_encoding(CONFIG, accept=png) == {'format': 'png', 'compress_level': 1}
+    # The browser does not accept any of the formats:
+    assert get_encoding(CONFIG, accept=MIMEAccept([('image/gif', 1)]))['format'] == 'png'
+
+
+def test_get_encoding_takes_request_arguments():
+    encoding = get_encoding(CONFIG, {'format': 'webp', 'lossless': '0', 'quality': '70'})
+    assert encoding == {'format': 'webp', 'lossless': False, 'quality': 70}
+
+    with pytest.raises(ValueError):
+        get_encoding(CONFIG, {'format': 'gif'})
+    with pytest.raises(ValueError):
+        get_encoding(CONFIG, {'format': 'jpeg', 'quality': 'high'})
+
+
+def test_get_encoding_checks_ranges():
+    assert get_encoding(CONFIG, {'format': 'png', 'compress_level': '9'})['compress_level'] == 9
+    assert get_encoding(CONFIG, {'format': 'webp', 'quality': '1'})['quality'] == 1
+
+    for args in [
+        {'format': 'png', 'compress_level': '42'},
+        {'format': 'png', 'compress_level': '-1'},
+        {'format': 'webp', 'quality': '500'},
+        {'format': 'webp', 'quality': '0'},
+    ]:
+        with pytest.raises(ValueError):
+            get_encoding(CONFIG, args)
+
+    # Only the formats of the config are allowed:
+    with pytest.raises(ValueError):
+        get_encoding(CONFIG, {'format': 'jpeg', 'quality': '-3'})
+    with pytest.raises(ValueError):
+        get_encoding({**CONFIG, 'formats': ['jpeg'], 'jpeg_quality': 101})
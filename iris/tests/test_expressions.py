@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from iris.expressions import BandExpression
+
+
+def test_band_expression_finds_bands():
+    expression = BandExpression("$Sentinel2.B1-$Sentinel2.B12*$Sentinel2.B1")
+    assert expression.bands == ['$Sentinel2.B1', '$Sentinel2.B12']
+
+
+def test_band_expression_evaluates_in_float32():
+    band = np.arange(6, dtype=np.uint16).reshape(2, 3)
+    image = {'S2': {'B1': band}, 'S1': {'B2': band.astype(np.float32)}}
+
+    result = BandExpression("-($S2.B1**2 + $S1.B2) / 2 * PI")(image)
+
+    assert result.dtype == np.float32
+    expected = -(band.astype(float)**2 + band) / 2 * np.pi
+    assert np.allclose(result, expected)
+    # The input bands must not be changed by in-place operations:
+    assert np.array_equal(image['S1']['B2'], band)
+
+
+def test_band_expression_calls_functions():
+    image = {'$B1': np.array([[1., 5.], [3., 2.]], dtype=np.float32)}
+    assert BandExpression("max($B1) - min($B1)")(image) == 4
+    assert BandExpression("edges($B1)")(image).shape == (2, 2)
+
+
+@pytest.mark.parametrize('expression', [
+    "__import__('os')", "$B1.__class__", "lambda: 1", "[$B1]", "'text'",
+    "$B1 if $B1 else 0", "eval('1')", "$B1 +",
+])
+def test_band_expression_rejects_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        BandExpression(expression)
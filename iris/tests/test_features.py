@@ -0,0 +1,22 @@
+import numpy as np
+
+from iris.features import build_features
+
+
+def test_build_features():
+    image = {
+        '$B1': np.arange(64, dtype=np.uint16).reshape(8, 8),
+        '$B2': np.ones((8, 8), dtype=np.float64),
+    }
+    ai_model = {
+        'use_edge_filter': True, 'use_meshgrid': True,
+        'meshgrid_cells': '3x3', 'use_superpixels': False,
+    }
+    features = build_features(image, ai_model)
+    assert features.shape == (64, 2 + 2 + 2)
+    assert features.dtype == np.float32
+    assert features.flags.c_contiguous
+    # One row per pixel in row-major order:
+    assert np.array_equal(features[:, 0], np.arange(64))
+    # Edges of a constant band:
+    assert np.all(features[:, 3] == 0)
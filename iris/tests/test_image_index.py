@@ -0,0 +1,52 @@
+from os.path import join
+import os
+
+import pytest
+
+from iris.image_index import ImageIndex
+
+
+def touch(*parts):
+    os.makedirs(join(*parts[:-1]), exist_ok=True)
+    open(join(*parts), 'w').close()
+
+
+def test_image_index_requires_all_files(tmp_path):
+    root = str(tmp_path)
+    for image_id in ['a', 'b', 'c']:
+        touch(root, image_id, 'S1.tif')
+    touch(root, 'a', 'S2.tif')
+    touch(root, 'b', 'S2.tif')
+
+    templates = [join(root, '{id}', 'S1.tif'), join(root, '{id}', 'S2.tif')]
+    index = ImageIndex(join(root, 'index.json'))
+    assert index.scan(templates) == ['a', 'b']
+
+    # New files are found from a fresh index loaded from disk:
+    touch(root, 'c', 'S2.tif')
+    touch(root, 'd', 'S1.tif')
+    touch(root, 'd', 'S2.tif')
+    assert ImageIndex(join(root, 'index.json')).scan(templates) == ['a', 'b', 'c', 'd']
+
+
+def test_image_index_with_id_in_filename(tmp_path):
+    root = str(tmp_path)
+    touch(root, 'images', 'scene_1.tif')
+    touch(root, 'images', 'scene_2.tif')
+    touch(root, 'images', 'other.tif')
+
+    index = ImageIndex(join(root, 'index.json'))
+    template = join(root, 'images', 'scene_{id}.tif')
+    assert index.scan([template]) == ['1', '2']
+    assert index.scan([template], full=True) == ['1', '2']
+
+
+def test_image_index_paths_are_literal(tmp_path):
+    root = str(tmp_path)
+    touch(root, 'images [2020]', 'a.tif')
+    touch(root, 'images [2020]', 'b.tif')
+
+    index = ImageIndex(join(root, 'index.json'))
+    assert index.scan([join(root, 'images [2020]', '{id}.tif')]) == ['a', 'b']
+    with pytest.raises(Exception, match='wildcards'):
+        index.scan([join(root, '*', '{id}.tif')])
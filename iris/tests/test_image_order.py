@@ -0,0 +1,22 @@
+from iris.image_order import ImageOrder
+
+
+def test_image_order():
+    image_ids = [str(i) for i in range(20)]
+    order = ImageOrder(image_ids, seed=3)
+
+    assert sorted(order.image_ids) == sorted(image_ids)
+    assert order.image_ids == ImageOrder(image_ids, seed=3).image_ids
+
+    first = order[0]
+    assert order.previous(order.next(first)) == first
+    assert order[len(order)] == first
+    assert len(list(order.following(first))) == len(image_ids) - 1
+
+    other = order[5]
+    assert order.distance(first, other) == 5
+    order.swap(other, order.next(first))
+    assert order.next(first) == other
+
+    # The shared list must never be changed:
+    assert image_ids == [str(i) for i in range(20)]
@@ -0,0 +1,55 @@
+import threading
+
+import pytest
+
+from iris.jobs import Job, JobCancelled, JobQueue, QueueFull
+
+
+def test_job_queue():
+    # Without workers, jobs run directly:
+    jobs = JobQueue()
+    job = jobs.submit('user1', lambda job, x: 2 * x, 21)
+    assert job.status == 'done' and job.result == 42
+    assert jobs.get(job.id) is job
+
+    jobs = JobQueue(max_workers=1, max_queued=1)
+    started, release = threading.Event(), threading.Event()
+
+    def block(job):
+        started.set()
+        release.wait(10)
+        return job.owner
+
+    running = jobs.submit('user1', block)
+    started.wait(10)
+    queued = jobs.submit('user2', block)
+    with pytest.raises(QueueFull):
+        jobs.submit('user3', block)
+    # A rejected job does not cancel the previous job of the user:
+    with pytest.raises(QueueFull):
+        jobs.submit('user1', block)
+    assert not running.cancelled.is_set()
+    assert jobs.get(running.id) is running
+
+    # A new job of the same user replaces the queued one:
+    replacement = jobs.submit('user2', block)
+    assert queued.status == 'cancelled'
+    assert jobs.get(queued.id) is None
+
+    release.set()
+    for job in (running, replacement):
+        assert job.done.wait(10)
+        assert job.status == 'done'
+    assert replacement.result == 'user2'
+    jobs.resize(0, 0)
+
+
+def test_cancelled_job_skips_process_pool():
+    jobs = JobQueue(max_workers=1, max_queued=1)
+    job = Job('user1')
+    assert jobs.run_in_process(job, abs, -3) == 3
+
+    job.cancelled.set()
+    with pytest.raises(JobCancelled):
+        jobs.run_in_process(job, abs, -3)
+    jobs.resize(0, 0)
@@ -0,0 +1,29 @@
+import json
+import os
+
+from iris.metadata_index import MetadataIndex
+
+
+def test_metadata_index(tmp_path):
+    files = {}
+    for i, resolution in enumerate([20, 10, 60]):
+        files[str(i)] = str(tmp_path / f'{i}.json')
+        with open(files[str(i)], 'w') as stream:
+            json.dump({'resolution': resolution, 'odd "key\'': -i}, stream)
+
+    index = MetadataIndex(str(tmp_path / 'metadata.db'))
+    assert index.update(files) == 3
+    assert index.update(files) == 0
+    assert index.sort(['0', '1', '2', '3'], 'resolution') == ['1', '0', '2', '3']
+    assert index.sort(['0', '1', '2'], 'resolution', ascending=False) == ['2', '0', '1']
+    # Keys can contain quotes:
+    assert index.sort(['0', '1', '2'], 'odd "key\'') == ['2', '1', '0']
+    assert index.sort(['0', '1', '2'], '$.") --') == ['0', '1', '2']
+
+    # Changed files are parsed again:
+    with open(files['0'], 'w') as stream:
+        json.dump({'resolution': 30}, stream)
+    os.utime(files['0'], (0, 0))
+    index = MetadataIndex(str(tmp_path / 'metadata.db'))
+    assert index.get('0', files['0']) == {'resolution': 30}
+    assert index.get('4', str(tmp_path / '4.json')) == {}
@@ -0,0 +1,34 @@
+import numpy as np
+
+from iris.model_store import ModelStore, encode_labels, get_label_change
+
+
+def test_model_store():
+    ai_model = {'warm_start': True, 'retrain_threshold': 0.5, 'n_estimators': 10}
+    indices = np.arange(100)
+    labels = indices % 2
+    codes = encode_labels(indices, labels)
+
+    models = ModelStore(max_models=2)
+    assert models.get_init_model(1, 'a', 'options', codes, ai_model) is None
+    model = {'model': '', 'n_iterations': 10, 'options': 'options', 'codes': codes}
+    models.put(1, 'a', model)
+
+    # A few new strokes:
+    new_codes = encode_labels(np.arange(120), np.arange(120) % 2)
+    assert abs(get_label_change(codes, new_codes) - 20 / 120) < 1e-9
+    assert models.get_init_model(1, 'a', 'options', new_codes, ai_model) is model
+    # Different options, a new class, or too many changed labels:
+    assert models.get_init_model(1, 'a', 'other', new_codes, ai_model) is None
+    assert models.get_init_model(
+        1, 'a', 'options', encode_labels(indices, indices % 3), ai_model
+    ) is None
+    assert models.get_init_model(
+        1, 'a', 'options', encode_labels(indices, 1 - labels), ai_model
+    ) is None
+
+    models.put(1, 'b', model)
+    models.put(2, 'a', model)
+    assert models.get(1, 'a') is None
+    assert models.drop(1) == 1
+    assert len(models) == 1
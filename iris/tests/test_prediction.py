@@ -0,0 +1,50 @@
+import numpy as np
+
+from iris.prediction import fit_and_predict, sample_pixels
+
+
+def test_sample_pixels():
+    width = 100
+    # A large stroke of class 0 over the upper half and a small one of class 1:
+    indices = np.r_[np.arange(50 * width), 80 * width + np.arange(40)]
+    labels = np.r_[np.zeros(50 * width, dtype=int), np.ones(40, dtype=int)]
+    ai_model = {'train_ratio': 0.8, 'max_train_pixels': 500}
+
+    train, train_labels, val, val_labels = sample_pixels(
+        indices, labels, width, ai_model, seed=1
+    )
+    assert np.sum(train_labels == 0) == 500
+    assert np.sum(train_labels == 1) == 32
+    assert np.sum(val_labels == 0) == 125
+    assert np.sum(val_labels == 1) == 8
+    assert not set(train) & set(val)
+    assert np.array_equal(labels[np.searchsorted(indices, train)], train_labels)
+
+    # The sampled pixels cover the whole stroke, not only a part of it:
+    rows = train[train_labels == 0] // width
+    cols = train[train_labels == 0] % width
+    assert rows.min() < 5 and rows.max() > 45
+    assert cols.min() < 5 and cols.max() > 95
+
+    # The same seed gives the same sample:
+    again = sample_pixels(indices, labels, width, ai_model, seed=1)
+    assert np.array_equal(train, again[0])
+
+
+def test_fit_and_predict_from_file(tmp_path):
+    rng = np.random.default_rng(0)
+    inputs = rng.random((20 * 20, 3), dtype=np.float32)
+    indices = np.arange(0, 400, 3)
+    labels = (inputs[indices, 0] > 0.5).astype(int)
+    ai_model = {
+        'train_ratio': 0.8, 'max_train_pixels': 1000, 'n_leaves': 8,
+        'max_depth': -1, 'n_estimators': 10, 'suppression_threshold': 0,
+    }
+    filename = str(tmp_path / 'features.npy')
+    np.save(filename, inputs)
+
+    # The worker processes memory-map the inputs from the file:
+    from_file = fit_and_predict(filename, indices, labels, ai_model, (20, 20))
+    from_array = fit_and_predict(inputs, indices, labels, ai_model, (20, 20))
+    assert np.array_equal(from_file[0], from_array[0])
+    assert from_file[1] == from_array[1]
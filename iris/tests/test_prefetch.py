@@ -0,0 +1,69 @@
+from datetime import datetime
+import threading
+
+from iris.prefetch import Prefetcher
+
+
+def test_prefetcher():
+    cache = {}
+    started, release = threading.Event(), threading.Event()
+
+    def fill(image_id, cancelled):
+        if image_id == 'slow':
+            started.set()
+            release.wait(10)
+            if cancelled.is_set():
+                return
+        cache[image_id] = cache.get(image_id, 0) + 1
+
+    prefetcher = Prefetcher(max_workers=1)
+    prefetcher.schedule('user1', 'image1', fill)
+    prefetcher.wait('user1', 10)
+    assert cache == {'image1': 1}
+
+    # The user went to another image before the task finished:
+    prefetcher.schedule('user1', 'slow', fill)
+    started.wait(10)
+    prefetcher.schedule('user1', 'slow', fill)
+    prefetcher.schedule('user1', 'image2', fill)
+    release.set()
+    prefetcher.wait('user1', 10)
+    assert cache == {'image1': 1, 'image2': 1}
+
+    # Without workers, nothing is prefetched:
+    prefetcher.resize(0)
+    prefetcher.schedule('user1', 'image3', fill)
+    assert 'image3' not in cache
+
+
+def test_index_with_removed_image(app):
+    from iris.models import db, Action, User
+    from iris.project import project
+
+    with app.app_context():
+        user = User(name='prefetch-test', image_seed=1)
+        db.session.add(user)
+        db.session.commit()
+        # The last image of the user is not part of the project anymore:
+        action = Action(
+            type='segmentation', image_id='removed', user_id=user.id,
+            last_modification=datetime(2100, 1, 1)
+        )
+        db.session.add(action)
+        db.session.commit()
+
+        try:
+            order = list(project.get_image_order(user).image_ids)
+            client = app.test_client()
+            with client.session_transaction() as session:
+                session['user_id'] = user.id
+            response = client.get('/segmentation/')
+            assert response.status_code == 200
+
+            # Prefetching only peeks at the next image:
+            assert project.get_image_order(user).image_ids == order
+            project.prefetcher.wait(user.id, 30)
+        finally:
+            db.session.delete(action)
+            db.session.delete(user)
+            db.session.commit()
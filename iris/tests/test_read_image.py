@@ -0,0 +1,89 @@
+import numpy as np
+from PIL import Image
+import pytest
+import rasterio
+from skimage.io import imsave
+
+from iris.project import get_image_header
+
+# Image with 3 bands, whose size is not a multiple of the decimation steps:
+HEIGHT, WIDTH = 301, 203
+IMAGE = (np.arange(HEIGHT * WIDTH * 3) % 251).astype(np.uint8).reshape(HEIGHT, WIDTH, 3)
+
+
+@pytest.fixture
+def files(tmp_path, make_project):
+    files = {
+        'npy': tmp_path / 'image.npy',
+        'png': tmp_path / 'image.png',
+        'tif': tmp_path / 'image.tif',
+    }
+    np.save(files['npy'], IMAGE)
+    # Band-major directory, see `iris convert`:
+    files['dir'] = tmp_path / 'bands'
+    files['dir'].mkdir()
+    for b in range(3):
+        np.save(files['dir'] / f'B{b+1}.npy', IMAGE[..., b])
+    imsave(files['png'], IMAGE, check_contrast=False)
+    with rasterio.open(
+            files['tif'], 'w', driver='GTiff', height=HEIGHT, width=WIDTH,
+            count=3, dtype='uint8') as file:
+        file.write(np.moveaxis(IMAGE, -1, 0))
+
+    project = make_project({
+        'images': {'path': 'image.{id}', 'shape': [WIDTH, HEIGHT]},
+        'views': {'RGB': {'data': ['$B1', '$B2', '$B3']}},
+    })
+    return project, {format: str(file) for format, file in files.items()}
+
+
+def test_decimated_shapes(files):
+    project, files = files
+    for out_shape in [(100, 100), (150, 60), (512, 512), (301, 100)]:
+        expected = IMAGE[::int(np.ceil(HEIGHT / out_shape[0])), ::int(np.ceil(WIDTH / out_shape[1]))]
+        for format, filename in files.items():
+            data = project.load_image(filename, out_shape=out_shape)
+            assert list(data) == ['B1', 'B2', 'B3']
+            assert data['B1'].shape == expected.shape[:2], (format, out_shape)
+            if format != 'tif':
+                # GDAL may pick other pixels when it resamples:
+                assert np.array_equal(np.dstack(list(data.values())), expected)
+
+
+def test_window(files):
+    project, files = files
+    xmin, ymin, xmax, ymax = window = [10, 20, 150, 250]
+    for format, filename in files.items():
+        full = project.load_image(filename)
+        data = project.load_image(filename, window=window)
+        assert list(data) == list(full)
+        for band in full:
+            assert np.array_equal(data[band], full[band][ymin:ymax, xmin:xmax]), format
+
+        # Only some bands of the window:
+        data = project.load_image(filename, bands=['$B3', '$B1'], window=window)
+        assert list(data) == ['B3', 'B1']
+        assert np.array_equal(data['B3'], IMAGE[ymin:ymax, xmin:xmax, 2]), format
+
+
+def test_image_header(files, tmp_path):
+    project, files = files
+    palette = Image.fromarray(IMAGE[..., 0] % 4).convert('P')
+    palette.putpalette([0, 0, 0, 255, 0, 0, 0, 255, 0, 0, 0, 255])
+    files['palette'] = str(tmp_path / 'palette.png')
+    palette.save(files['palette'])
+    files['transparent'] = str(tmp_path / 'transparent.png')
+    palette.save(files['transparent'], transparency=0)
+    files['gray'] = str(tmp_path / 'gray.png')
+    imsave(files['gray'], IMAGE[..., 0], check_contrast=False)
+
+    n_bands = {'palette': 3, 'transparent': 4, 'gray': 1}
+    for format, filename in files.items():
+        header = get_image_header(filename)
+        assert header == (HEIGHT, WIDTH, n_bands.get(format, 3)), format
+        # The loader returns as many bands as the header announces:
+        assert len(project.load_image(filename)) == header[2], format
+
+    # Palette images are expanded to their colours:
+    data = project.load_image(files['palette'])
+    assert np.array_equal(data['B1'], np.where(IMAGE[..., 0] % 4 == 1, 255, 0))
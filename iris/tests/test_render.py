@@ -0,0 +1,70 @@
+import matplotlib
+import numpy as np
+import pytest
+
+# Image with 4x5 pixels and three bands:
+ROWS, COLS = np.mgrid[0:4, 0:5]
+IMAGE = np.dstack([
+    10 * (5*ROWS + COLS), 200 - 10 * (5*ROWS + COLS), (ROWS*COLS) % 7 * 30
+]).astype(np.uint16)
+
+VIEWS = {
+    'Gray': {'data': '$B1', 'cmap': 'gray', 'vmin': 0, 'vmax': 190},
+    'Jet': {'data': '$B1/10', 'cmap': 'jet'},
+    'RGB': {'data': ['$B1', '$B2', '$B3']},
+    'Clip': {'data': ['$B1', '$B2', '$B3'], 'clip': 10},
+    'Bounds': {'data': ['$B1', '$B2', '$B3'], 'vmin': 50, 'vmax': 150},
+    'Vmin': {'data': ['$B1', '$B2', '$B3*2'], 'vmin': 100},
+}
+
+
+@pytest.fixture
+def project(tmp_path, make_project):
+    np.save(tmp_path / 'image1.npy', IMAGE)
+    return make_project({
+        'images': {'path': 'image{id}.npy', 'shape': [5, 4]},
+        'views': VIEWS,
+    })
+
+
+def render_reference(bands, bounds, cmap=None):
+    """Render like IRIS did before the views were quantised in float32"""
+    channels = [
+        np.clip((band - vmin) / (vmax - vmin), 0, 1)
+        for band, (vmin, vmax) in zip(bands, bounds)
+    ]
+    if cmap is not None:
+        colours = matplotlib.colormaps[cmap](channels[0])[..., :3]
+    else:
+        colours = np.dstack(channels)
+    return (255 * colours).astype(np.uint8)
+
+
+def test_render_matches_reference(project):
+    r, g, b = np.moveaxis(IMAGE.astype(float), 2, 0)
+    references = {
+        'Gray': render_reference([r], [(0, 190)], 'gray'),
+        'RGB': render_reference([r, g, b], [(0, 190), (10, 200), (0, 180)]),
+        'Bounds': render_reference([r, g, b], [(50, 150)] * 3),
+        'Vmin': render_reference([r, g, 2*b], [(100, 190), (100, 200), (100, 360)]),
+    }
+    for name, reference in references.items():
+        rendered = project.render_image('1', project['views'][name])
+        assert rendered.dtype == np.uint8 and rendered.shape == (4, 5, 3)
+        # Up to float32 rounding:
+        assert np.abs(rendered.astype(int) - reference).max() <= 1, name
+
+
+def test_render_pixel_values(project):
+    # Third row of the image, one list per colour channel:
+    expected = {
+        'Gray': [[134, 147, 161, 175, 188]] * 3,
+        'Jet': [[144, 189, 231, 255, 255], [255, 255, 255, 211, 163], [102, 57, 15, 0, 0]],
+        'RGB': [[134, 147, 161, 174, 187], [120, 107, 93, 80, 67], [0, 85, 170, 255, 42]],
+        'Clip': [[135, 152, 169, 186, 202], [119, 102, 85, 68, 52], [0, 100, 200, 255, 50]],
+        'Bounds': [[127, 153, 178, 204, 229], [127, 102, 76, 51, 25], [0, 25, 178, 255, 0]],
+        'Vmin': [[0, 28, 56, 85, 113], [0, 0, 0, 0, 0], [0, 19, 137, 255, 0]],
+    }
+    for name, rows in expected.items():
+        rendered = project.render_image('1', project['views'][name])
+        assert rendered[2].T.tolist() == rows, name
@@ -0,0 +1,46 @@
+import numpy as np
+from PIL import Image
+
+from iris.project import get_thumbnail_size
+
+
+def test_thumbnail_size():
+    assert get_thumbnail_size((10, 10)) == 64
+    assert get_thumbnail_size((64, 20)) == 64
+    assert get_thumbnail_size((50, 100)) == 128
+    assert get_thumbnail_size((2000, 10)) == 512
+    assert get_thumbnail_size(None) == 512
+
+
+def test_thumbnail_file(tmp_path, make_project):
+    # Image of 300x200 pixels, only the first image has a thumbnail file:
+    image = (np.arange(200 * 300 * 3) % 256).astype(np.uint8).reshape(200, 300, 3)
+    for image_id in ['1', '2']:
+        np.save(tmp_path / f'image{image_id}.npy', image)
+    Image.fromarray(image).save(tmp_path / 'thumbnail1.png')
+
+    project = make_project({
+        'images': {
+            'path': 'image{id}.npy', 'shape': [300, 200],
+            'thumbnails': 'thumbnail{id}.png', 'thumbnail_view': 'RGB',
+        },
+        'views': {'RGB': {'data': ['$B1', '$B2', '$B3']}},
+    })
+    encoding = {'format': 'png', 'compress_level': 1}
+
+    for size, shape in [((50, 50), (43, 64)), ((100, 20), (85, 128)), (None, (200, 300))]:
+        filename = project.get_thumbnail_file('1', size, encoding)
+        assert np.asarray(Image.open(filename)).shape == shape + (3,)
+
+        # Thumbnails rendered from the view are decimated, hence they can be
+        # smaller but never larger than the bucket:
+        filename = project.get_thumbnail_file('2', size, encoding)
+        height, width, _ = np.asarray(Image.open(filename)).shape
+        assert max(height, width) <= get_thumbnail_size(size)
+        assert abs(width / height - 1.5) < 0.1
+
+    # Sizes in the same bucket share the cached file:
+    assert project.get_thumbnail_file('1', (30, 30), encoding) \
+        == project.get_thumbnail_file('1', (64, 64), encoding)
+    assert project.get_thumbnail_file('1', (30, 30), encoding) \
+        != project.get_thumbnail_file('1', (65, 65), encoding)
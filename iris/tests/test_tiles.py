@@ -0,0 +1,18 @@
+from iris.tiles import get_max_zoom, get_tile_window, iterate_tiles
+
+
+def test_tile_pyramid():
+    height, width = 1000, 600
+    assert get_max_zoom(height, width) == 2
+    assert get_max_zoom(200, 100) == 0
+
+    # Zoom level 0 shows the whole image:
+    assert get_tile_window(height, width, 0, 0, 0) == ([0, 0, 600, 1000], (250, 150))
+    # Tiles at the border are smaller:
+    assert get_tile_window(height, width, 2, 2, 3) == ([512, 768, 600, 1000], (232, 88))
+    assert get_tile_window(height, width, 2, 3, 0) is None
+    assert get_tile_window(height, width, 3, 0, 0) is None
+
+    tiles = list(iterate_tiles(height, width))
+    assert len(tiles) == 1 + 2*2 + 3*4
+    assert all(get_tile_window(height, width, *tile) for tile in tiles)
@@ -0,0 +1,20 @@
+import copy
+
+import pytest
+
+from iris.utils import freeze, unfreeze
+
+
+def test_freeze():
+    config = {'segmentation': {'mask_area': [0, 0, 10, 10], 'classes': [{'name': 'Clear'}]}}
+    frozen = freeze(config)
+
+    assert frozen == {'segmentation': {'mask_area': (0, 0, 10, 10), 'classes': ({'name': 'Clear'},)}}
+    with pytest.raises(TypeError):
+        frozen['segmentation']['mask_area'] = None
+    with pytest.raises(TypeError):
+        frozen['segmentation']['classes'][0].update(name='Cloud')
+
+    copied = copy.deepcopy(frozen)
+    copied['segmentation']['mask_area'][0] = 5
+    assert unfreeze(frozen) == config
@@ -0,0 +1,54 @@
+"""Split large images into a pyramid of map tiles
+
+The tiles follow the XYZ scheme of web maps: zoom level 0 shows the whole
+image in one tile, each further level doubles the resolution until the full
+resolution is reached. The tiles at the right and bottom border of an image are
+smaller than TILE_SIZE.
+"""
+import math
+
+TILE_SIZE = 256
+
+
+def get_max_zoom(height, width):
+    """Get the zoom level at which the tiles have the full resolution"""
+    return max(0, math.ceil(math.log2(max(height, width) / TILE_SIZE)))
+
+
+def get_tile_window(height, width, z, x, y):
+    """Get the part of an image which is covered by a tile
+
+    Args:
+        height, width: Size of the full resolution image in pixels.
+        z, x, y: Zoom level and position of the tile.
+
+    Returns:
+        A tuple of the pixel window [xmin, ymin, xmax, ymax] in the full
+        resolution image and the shape (height, width) of the tile. None if
+        the tile does not exist.
+    """
+    max_zoom = get_max_zoom(height, width)
+    if not 0 <= z <= max_zoom:
+        return None
+
+    # Number of full resolution pixels per tile pixel:
+    factor = 2 ** (max_zoom - z)
+    size = TILE_SIZE * factor
+    if not (0 <= x < math.ceil(width / size) and 0 <= y < math.ceil(height / size)):
+        return None
+
+    xmin, ymin = x * size, y * size
+    xmax, ymax = min(width, xmin + size), min(height, ymin + size)
+    out_shape = (
+        math.ceil((ymax - ymin) / factor), math.ceil((xmax - xmin) / factor)
+    )
+    return [xmin, ymin, xmax, ymax], out_shape
+
+
+def iterate_tiles(height, width):
+    """Iterate over the positions (z, x, y) of all tiles of an image"""
+    for z in range(get_max_zoom(height, width) + 1):
+        size = TILE_SIZE * 2 ** (get_max_zoom(height, width) - z)
+        for y in range(math.ceil(height / size)):
+            for x in range(math.ceil(width / size)):
+                yield z, x, y
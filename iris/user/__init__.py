@@ -139,11 +139,13 @@ def config():
     all_bands = project.get_image_bands(project.image_ids[0])
 
     # If no specific bands set for model, use all bands:
-    if config['segmentation']['ai_model']['bands'] is None:
-        config['segmentation']['ai_model']['bands'] = all_bands
+    model_bands = config['segmentation']['ai_model']['bands']
+    if model_bands is None:
+        model_bands = all_bands
 
     return flask.render_template(
-        'user/config.html', config=config, all_bands=all_bands
+        'user/config.html', config=config, all_bands=all_bands,
+        model_bands=model_bands
     )
 
 @user_app.route('/save_config', methods=['POST'])
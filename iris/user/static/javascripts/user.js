@@ -48,6 +48,8 @@ async function dialogue_config_save(){
         "n_leaves": parseInt(get_object('dcs-n_leaves').value),
         "train_ratio": get_object('dcs-train_ratio').value / 100,
         "max_train_pixels": parseInt(get_object('dcs-max_train_pixels').value),
+        "warm_start": get_object('dcs-warm_start').checked,
+        "retrain_threshold": get_object('dcs-retrain_threshold').value / 100,
         "use_edge_filter": get_object('dcs-use_edge_filter').checked,
         "use_meshgrid": get_object('dcs-use_meshgrid').checked,
         "meshgrid_cells": get_object('dcs-meshgrid_cells').value,
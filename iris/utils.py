@@ -1,7 +1,10 @@
 from copy import deepcopy
+import io
 
 import flask
 import markupsafe
+import numpy as np
+from PIL import Image as PILImage
 
 
 class View:
@@ -24,3 +27,60 @@ def merge_deep_dicts(d1, d2):
         else:
             merged[k] = merge_deep_dicts(merged[k], v)
     return merged
+
+class ReadOnlyDict(dict):
+    """Dictionary which cannot be changed, see freeze"""
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('This dictionary is read-only, copy it first!')
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return unfreeze(self)
+
+def freeze(value):
+    """Make a (nested) structure of dicts and lists read-only
+
+    Dicts become ReadOnlyDicts and lists become tuples, so that the value can be
+    shared without copying it.
+    """
+    if isinstance(value, dict):
+        return ReadOnlyDict({k: freeze(v) for k, v in value.items()})
+    elif isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+def unfreeze(value):
+    """Get a changeable deep copy of a value made read-only by freeze"""
+    if isinstance(value, dict):
+        return {k: unfreeze(v) for k, v in value.items()}
+    elif isinstance(value, tuple):
+        return [unfreeze(v) for v in value]
+    return deepcopy(value)
+
+def array_to_bytes(array, format='PNG', **options):
+    """Encode an image array into the bytes of an image file
+
+    Args:
+        array: Image as HxW or HxWx3 array. Float arrays are expected to be
+            between 0 and 1.
+        format: Image file format understood by PIL, e.g. 'PNG'.
+        **options: Options for the encoder of PIL, e.g. quality=90.
+
+    Returns:
+        The encoded image file as bytes.
+    """
+    if issubclass(array.dtype.type, np.floating):
+        array = np.clip(array * 255., 0, 255).astype('uint8')
+
+    img = PILImage.fromarray(array) # convert arr to image
+    if format.upper() == 'JPEG' and img.mode not in ('L', 'RGB'):
+        # JPEG does not support transparency:
+        img = img.convert('RGB')
+    file_object = io.BytesIO()   # create file in memory
+    img.save(file_object, format, **options) # save image in file in memory
+    return file_object.getvalue()